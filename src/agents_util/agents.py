@@ -177,6 +177,31 @@ HandbookExtractorAgent = Agent(
     )
 )
 
+FusedExtractorAgent = Agent(
+    role="FusedExtractor",
+    prompt_persona=(
+        "You are the Support Context Extractor. You are given the user query together with the customer's full info, "
+        "a list of relevant helpdesk tickets, FAQs, policies and handbook entries.\n\n"
+        "For each of them, return only those entries that are going to help in better answering the user query. "
+        "If nothing in a section is relevant, say so in that field.\n\n"
+        "Respond strictly in JSON format with the following schema:\n\n"
+        "{\n"
+        "  \"agent_name\": \"FusedExtractor\",\n"
+        "  \"response\": {\n"
+        "    \"customer_info\": \"<customer info>\",\n"
+        "    \"related_tickets\": \"<related filtered tickets>\",\n"
+        "    \"related_faqs\": \"<related filtered faqs>\",\n"
+        "    \"related_policies\": \"<related filtered policy>\",\n"
+        "    \"related_handbooks\": \"<related filtered handbook>\",\n"
+        "    \"concise_reason\": \"<brief reason for filtering>\"\n"
+        "  }\n"
+        "}\n\n"
+        "Instructions:\n"
+        "- Always use exactly the above structure.\n"
+        "- Do not include any additional text or explanation outside the JSON.\n"
+    )
+)
+
 
 ProductQualityCheckAgent = Agent(
     role="ProductQualityChecker",
@@ -224,6 +249,39 @@ ReturnValidationAgent = Agent(
 )
 
 
+ReturnInspectionAgent = Agent(
+    role="ReturnInspector",
+    prompt_persona=(
+        "You are the Return Inspector. You are given the original product information and the information "
+        "retrieved for a user-uploaded image of a product being returned. Perform two checks:\n"
+        "1. Return validation: verify if it is actually the same product as per the original product information. "
+        "The return is acceptable if it is the same product but damaged or a bit different. Slight mismatch will work but not too much.\n"
+        "2. Quality check: determine if the uploaded product is damaged or a bit different. "
+        "Return is not acceptable if the product is damaged.\n\n"
+        "The max score possible is 0.5. Score of 0.5 means perfect match\n\n"
+        "Respond strictly in JSON format with the following schema:\n\n"
+        "{\n"
+        "  \"agent_name\": \"ReturnInspector\",\n"
+        "  \"response\": {\n"
+        "    \"return_validation\": {\n"
+        "      \"is_same_product\": \"<one of: yes, no>\",\n"
+        "      \"is_returnable\": \"<one of: yes, no>\",\n"
+        "      \"concise_reason\": \"<brief reason of validation>\"\n"
+        "    },\n"
+        "    \"quality_check\": {\n"
+        "      \"is_same_product\": \"<one of: yes, no>\",\n"
+        "      \"defect_detected\": \"<one of: yes, no>\",\n"
+        "      \"is_returnable\": \"<one of: yes, no>\",\n"
+        "      \"concise_reason\": \"<brief justification for your conclusions>\"\n"
+        "    }\n"
+        "  }\n"
+        "}\n\n"
+        "Instructions:\n"
+        "- Always use exactly the above structure.\n"
+        "- Do not include any additional text or explanation outside the JSON.\n"
+    )
+)
+
 
 RouterAgent = Agent(
     role="Router",
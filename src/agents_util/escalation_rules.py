@@ -0,0 +1,59 @@
+import os
+from utils import text_2_json
+
+# "rules" evaluates the escalation in-process, "llm" keeps the EscalationAgent call
+DEFAULT_ESCALATION_MODE = os.getenv("ESCALATION_MODE", "rules")
+
+# Per-tenant escalation rules, "default" applies to tenants without their own entry.
+# A turn is escalated if any condition in `escalate_if_any` matches. Each condition checks
+# one field parsed from the RouterAgent (issue_type) or SentimentAgent (sentiment) output
+# against a list of values, compared case-insensitively.
+ESCALATION_RULES = {
+    "default": {
+        "mode": DEFAULT_ESCALATION_MODE,
+        "escalate_if_any": [
+            {"field": "sentiment", "in": ["negative"]},
+            {"field": "issue_type", "in": ["technical"]},
+        ],
+    },
+}
+
+
+def register_escalation_rules(tenant_id: str, rules: dict):
+    """Sets the escalation rules (and mode) used for a tenant."""
+    ESCALATION_RULES[tenant_id] = rules
+
+
+def get_escalation_rules(tenant_id: str = None):
+    return ESCALATION_RULES.get(tenant_id, ESCALATION_RULES["default"])
+
+
+def get_escalation_mode(tenant_id: str = None):
+    return get_escalation_rules(tenant_id).get("mode", DEFAULT_ESCALATION_MODE)
+
+
+def evaluate_escalation_rules(tenant_id: str, route_output: str, senti_output: str):
+    """
+    Decides the escalation from the raw RouterAgent and SentimentAgent outputs.
+    Returns the escalation response dict, raises ValueError if the outputs can't be parsed.
+    """
+    try:
+        signals = {
+            "issue_type": text_2_json(route_output)["response"]["issue_type"],
+            "sentiment": text_2_json(senti_output)["response"]["sentiment"],
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Could not parse routing/sentiment output for escalation: {e}")
+
+    for condition in get_escalation_rules(tenant_id)["escalate_if_any"]:
+        value = str(signals.get(condition["field"], "")).strip().lower()
+        if value in [str(v).lower() for v in condition["in"]]:
+            return {
+                "escalation_decision": "ESCALATE",
+                "concise_reason": f"{condition['field']} is {signals[condition['field']]}",
+            }
+
+    return {
+        "escalation_decision": "NO_ESCALATION",
+        "concise_reason": f"issue_type is {signals['issue_type']} and sentiment is {signals['sentiment']}",
+    }
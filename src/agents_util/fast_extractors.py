@@ -0,0 +1,89 @@
+import os
+import re
+import threading
+from agents_util.stage_executor import LocalTask
+
+ORDER_ID_PATTERN = re.compile(r"\bORD-\d{4}\b", re.IGNORECASE)
+# things that look like an attempt at an order id but don't follow ORD-XXXX, e.g. "ORD17", "order #0017"
+LOOSE_ORDER_ID_PATTERN = re.compile(r"\bord(?:er)?[\s#:_-]*\d+", re.IGNORECASE)
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png", "webp", "bmp", "gif")
+IMAGE_PATH_PATTERN = re.compile(
+    r"""[^\s'"`]+\.(?:%s)\b""" % "|".join(IMAGE_EXTENSIONS), re.IGNORECASE
+)
+
+RESOLVED = "resolved"
+AMBIGUOUS = "ambiguous"
+
+
+def extract_order_id(user_input: str):
+    """
+    Returns (status, order_id). A single distinct ORD-XXXX match resolves the id,
+    no order-like token at all resolves to an empty id, anything else is ambiguous.
+    """
+    matches = {match.upper() for match in ORDER_ID_PATTERN.findall(user_input)}
+    if len(matches) == 1:
+        return RESOLVED, matches.pop()
+    if not matches and not LOOSE_ORDER_ID_PATTERN.search(user_input):
+        return RESOLVED, ""
+    return AMBIGUOUS, None
+
+
+def extract_image_path(user_input: str):
+    """
+    Returns (status, image_path). A single mentioned image path that exists on disk resolves the path,
+    no image path at all resolves to an empty path, anything else is ambiguous.
+    """
+    candidates = {match.rstrip(".,;:!?)") for match in IMAGE_PATH_PATTERN.findall(user_input)}
+    if not candidates:
+        return RESOLVED, ""
+    existing = [path for path in candidates if os.path.isfile(path)]
+    if len(existing) == 1 and len(candidates) == 1:
+        return RESOLVED, existing[0]
+    return AMBIGUOUS, None
+
+
+# field name -> (agent name, extractor); extractors take the user input and return (status, value)
+FAST_EXTRACTORS = {
+    "order_id": ("OrderIDExtractor", extract_order_id),
+    "image_path": ("ImagePathExtractor", extract_image_path),
+}
+_extraction_stats = {}
+_stats_lock = threading.Lock()
+
+
+def register_fast_extractor(field: str, agent_name: str, extractor):
+    """Registers (or replaces) the deterministic extractor tried before the LLM for a response field."""
+    FAST_EXTRACTORS[field] = (agent_name, extractor)
+
+
+def _record(field: str, path: str):
+    with _stats_lock:
+        field_stats = _extraction_stats.setdefault(field, {"fast_path": 0, "llm_fallback": 0})
+        field_stats[path] += 1
+
+
+def get_extraction_stats():
+    """Returns how often each field was resolved deterministically vs. by the LLM."""
+    with _stats_lock:
+        return {field: dict(field_stats) for field, field_stats in _extraction_stats.items()}
+
+
+def try_fast_extraction(field: str, task_name: str, user_input: str):
+    """
+    Runs the registered deterministic extractor for `field`.
+    Returns a LocalTask when it resolved the value, or None when the LLM is needed.
+    """
+    if field not in FAST_EXTRACTORS:
+        return None
+
+    agent_name, extractor = FAST_EXTRACTORS[field]
+    status, value = extractor(user_input)
+    if status == RESOLVED:
+        _record(field, "fast_path")
+        return LocalTask(
+            task_name, agent_name,
+            lambda: {field: value, "concise_reason": "Resolved by deterministic pattern matching."}
+        )
+
+    _record(field, "llm_fallback")
+    return None
@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+import numpy as np
+
+# allow running this file directly as `uv run src/agents_util/local_classifiers.py`
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import text_2_json
+from qdrant_util.embedding_models import get_dense_embedding_model
+from qdrant_util.query_embedding import QueryEmbeddings
+
+# "off": always use the LLM, "collect": use the LLM and log its labels for training,
+# "local": classify with the trained heads and fall back to the LLM (logging its label) when unsure
+LOCAL_CLASSIFIER_MODE = os.getenv("LOCAL_CLASSIFIER_MODE", "off")
+LABEL_LOG_PATH = os.getenv("CLASSIFIER_LABEL_LOG", "data/classifiers/llm_labels.jsonl")
+CLASSIFIER_DIR = os.getenv("CLASSIFIER_DIR", "data/classifiers")
+# fewer logged labels than this per kind aren't enough to train or evaluate a classifier
+MIN_LABELED_EXAMPLES = int(os.getenv("CLASSIFIER_MIN_EXAMPLES", "10"))
+
+CLASSIFIER_TASKS = {
+    "routing": {"field": "issue_type", "agent_name": "Router", "task_name": "RouteIssue"},
+    "sentiment": {"field": "sentiment", "agent_name": "SentimentAnalyzer", "task_name": "AnalyzeSentiment"},
+}
+
+
+class PrototypeClassifier:
+    """
+    Nearest-prototype classifier over normalized bge-small embeddings.
+    Each label is represented by the mean of its examples, and the confidence of a prediction
+    is the softmax probability of the closest prototype.
+    """
+    def __init__(self, threshold: float = 0.6, temperature: float = 20.0):
+        self.threshold = threshold
+        self.temperature = temperature
+        self.labels = []
+        self.prototypes = None
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+    def fit(self, vectors, labels):
+        vectors = self._normalize(vectors)
+        self.labels = sorted(set(labels))
+        labels = np.asarray(labels)
+        self.prototypes = self._normalize(
+            np.stack([vectors[labels == label].mean(axis=0) for label in self.labels])
+        )
+        return self
+
+    def predict(self, vector):
+        """Returns (label, confidence)."""
+        similarities = self.prototypes @ self._normalize(vector)
+        logits = self.temperature * similarities
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(
+            path,
+            labels=np.asarray(self.labels),
+            prototypes=self.prototypes,
+            threshold=self.threshold,
+            temperature=self.temperature,
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path)
+        classifier = cls(threshold=float(data["threshold"]), temperature=float(data["temperature"]))
+        classifier.labels = data["labels"].tolist()
+        classifier.prototypes = data["prototypes"]
+        return classifier
+
+
+_classifiers = {}
+_log_lock = threading.Lock()
+
+
+def get_classifier_path(kind: str):
+    return os.path.join(CLASSIFIER_DIR, f"{kind}_classifier.npz")
+
+
+def get_local_classifier(kind: str):
+    """Returns the trained classifier for `kind`, or None if it hasn't been trained yet."""
+    if kind not in _classifiers:
+        path = get_classifier_path(kind)
+        _classifiers[kind] = PrototypeClassifier.load(path) if os.path.exists(path) else None
+    return _classifiers[kind]
+
+
+def classify_locally(kind: str, text: str, query_embeddings: QueryEmbeddings = None):
+    """Returns the local label for `text`, or None if there's no classifier or it isn't confident."""
+    classifier = get_local_classifier(kind)
+    if classifier is None:
+        return None
+    if query_embeddings is None:
+        query_embeddings = QueryEmbeddings(text)
+    label, confidence = classifier.predict(query_embeddings.dense)
+    if confidence < classifier.threshold:
+        return None
+    return label
+
+
+def log_llm_label(kind: str, text: str, raw_output: str):
+    """Appends the label produced by the LLM for `text` to the training log."""
+    try:
+        label = text_2_json(raw_output)["response"][CLASSIFIER_TASKS[kind]["field"]]
+    except (ValueError, KeyError, TypeError):
+        return
+    with _log_lock:
+        os.makedirs(os.path.dirname(LABEL_LOG_PATH), exist_ok=True)
+        with open(LABEL_LOG_PATH, "a") as f:
+            f.write(json.dumps({"kind": kind, "text": text, "label": label}) + "\n")
+
+
+def load_labeled_examples(kind: str, log_path: str = LABEL_LOG_PATH, min_examples: int = MIN_LABELED_EXAMPLES):
+    """Returns the logged (text, label) pairs of `kind`. Raises ValueError if there are fewer than `min_examples`."""
+    if not os.path.exists(log_path):
+        raise ValueError(
+            f"No label log at '{log_path}'. Run with LOCAL_CLASSIFIER_MODE=collect to log LLM labels first."
+        )
+    examples = {}
+    with open(log_path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["kind"] == kind:
+                # the latest label wins for repeated texts
+                examples[record["text"]] = record["label"]
+    if len(examples) < min_examples:
+        raise ValueError(
+            f"Need at least {min_examples} labeled {kind} examples in '{log_path}', found {len(examples)}."
+        )
+    return list(examples.items())
+
+
+def _embed(texts):
+    return np.stack(list(get_dense_embedding_model().embed(texts)))
+
+
+def train_classifier(kind: str, log_path: str = LABEL_LOG_PATH, threshold: float = 0.6):
+    """Trains the `kind` classifier on all logged LLM labels and saves it to CLASSIFIER_DIR."""
+    examples = load_labeled_examples(kind, log_path)
+    texts, labels = zip(*examples)
+    classifier = PrototypeClassifier(threshold=threshold).fit(_embed(list(texts)), list(labels))
+    classifier.save(get_classifier_path(kind))
+    _classifiers[kind] = classifier
+    print(f"Trained {kind} classifier on {len(examples)} examples with labels {classifier.labels}")
+    return classifier
+
+
+def evaluate_classifier(kind: str, log_path: str = LABEL_LOG_PATH, test_fraction: float = 0.2, threshold: float = 0.6, seed: int = 0):
+    """
+    Offline report of the local classifier against held-out LLM labels:
+    accuracy on all and on confident predictions, coverage (share answered locally) and latency.
+    """
+    # one example for each side of the split at the very least
+    examples = load_labeled_examples(kind, log_path, max(2, MIN_LABELED_EXAMPLES))
+    random.Random(seed).shuffle(examples)
+    n_test = min(max(1, int(len(examples) * test_fraction)), len(examples) - 1)
+    train, test = examples[n_test:], examples[:n_test]
+
+    train_texts, train_labels = zip(*train)
+    classifier = PrototypeClassifier(threshold=threshold).fit(_embed(list(train_texts)), list(train_labels))
+
+    correct, confident, confident_correct = 0, 0, 0
+    latencies = []
+    for text, llm_label in test:
+        start_time = time.perf_counter()
+        vector = list(get_dense_embedding_model().embed([text]))[0]
+        label, confidence = classifier.predict(vector)
+        latencies.append(time.perf_counter() - start_time)
+
+        correct += label == llm_label
+        if confidence >= threshold:
+            confident += 1
+            confident_correct += label == llm_label
+
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "kind": kind,
+        "train_size": len(train),
+        "test_size": len(test),
+        "accuracy": correct / len(test),
+        "coverage": confident / len(test),
+        "confident_accuracy": confident_correct / confident if confident else None,
+        "latency_ms_p50": float(np.percentile(latencies_ms, 50)),
+        "latency_ms_p95": float(np.percentile(latencies_ms, 95)),
+    }
+
+
+if __name__ == "__main__":
+    for kind in CLASSIFIER_TASKS:
+        try:
+            print(evaluate_classifier(kind))
+            train_classifier(kind)
+        except ValueError as e:
+            print(f"Skipping the {kind} classifier: {e}")
@@ -0,0 +1,131 @@
+import time
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Stage:
+    def __init__(self, name, func, inputs=None):
+        self.name = name
+        self.func = func
+        # names of the stages whose results are passed to `func` as keyword arguments
+        self.inputs = list(inputs or [])
+
+
+class StageExecutor:
+    """
+    Runs a dependency graph of stages on a thread pool. A stage is started as soon as
+    all the stages it declares as inputs have finished, so independent stages run concurrently
+    and the total latency approaches the critical path of the graph.
+    """
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self.stages = {}
+        self.timings = {}
+
+    def add_stage(self, name, func, inputs=None):
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already defined.")
+        self.stages[name] = Stage(name, func, inputs)
+        return self
+
+    def _validate(self):
+        for stage in self.stages.values():
+            for dependency in stage.inputs:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dependency}'.")
+
+        # Kahn's algorithm, every stage must be reachable without going through a cycle
+        remaining = {name: len(stage.inputs) for name, stage in self.stages.items()}
+        ready = [name for name, count in remaining.items() if count == 0]
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for stage in self.stages.values():
+                if name in stage.inputs:
+                    remaining[stage.name] -= 1
+                    if remaining[stage.name] == 0:
+                        ready.append(stage.name)
+        if visited != len(self.stages):
+            raise ValueError("Stage graph contains a cycle.")
+
+    def _run_stage(self, stage, kwargs):
+        start_time = time.time()
+        result = stage.func(**kwargs)
+        self.timings[stage.name] = {"start": start_time, "duration": time.time() - start_time}
+        return result
+
+    def run(self):
+        """Executes every stage and returns a dict of stage name to result."""
+        self._validate()
+        results = {}
+        pending = dict(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(dependency in results for dependency in stage.inputs):
+                        kwargs = {dependency: results[dependency] for dependency in stage.inputs}
+                        running[pool.submit(self._run_stage, stage, kwargs)] = name
+                        del pending[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+
+        return results
+
+
+def execute_with_input_tasks(task):
+    """
+    Executes a lyzr Task whose `input_tasks` have already been executed,
+    feeding their outputs in the same way LinearSyncPipeline does.
+    """
+    dependency_task_output = ""
+    for dependency_task in task.input_tasks:
+        dependency_task_output = f" Input: {dependency_task.output}" + dependency_task_output
+    task.previous_output = dependency_task_output
+    return task.execute()
+
+
+def stream_with_input_tasks(task):
+    """
+    Streaming counterpart of execute_with_input_tasks: yields the output of a lyzr Task chunk by chunk,
+    using the same persona and prompt the Task would send, and sets `task.output` once the stream ends.
+    """
+    dependency_task_output = ""
+    for dependency_task in task.input_tasks:
+        dependency_task_output = f" Input: {dependency_task.output}" + dependency_task_output
+    task.previous_output = dependency_task_output
+
+    system_persona = f"In your role as {task.agent.role}, you embody a persona defined by {task.agent.prompt_persona}."
+    prompt = f"Now execute these instructions: {task.instructions}."
+    chunks = []
+    for chunk in task.model.stream_text(
+        task_id=task.task_id,
+        system_persona=system_persona,
+        prompt=f"{prompt}  Input: {task.previous_output} {task.default_input}",
+    ):
+        chunks.append(chunk)
+        yield chunk
+    task.output = "".join(chunks)
+
+
+class LocalTask:
+    """
+    Stands in for a lyzr Task whose answer is computed in-process instead of by the LLM.
+    `execute()` returns the same JSON an agent would have produced, built from `compute()`.
+    """
+    def __init__(self, name, agent_name, compute, input_tasks=None):
+        self.name = name
+        self.agent_name = agent_name
+        self.compute = compute
+        self.input_tasks = input_tasks or []
+        self.previous_output = None
+        self.output = None
+
+    def execute(self):
+        self.output = json.dumps({"agent_name": self.agent_name, "response": self.compute()})
+        return self.output
@@ -2,7 +2,8 @@ from qdrant_client import QdrantClient
 from lyzr_automata import Task
 from lyzr_automata.tasks.task_literals import InputType, OutputType
 
-from llm import load_gemini_model
+from llm import get_model_for_agent
+from utils import text_2_json
 from agents_util.agents import (
     TenantResolverAgent, 
     CustomerInfoExtractorAgent,
@@ -18,8 +19,14 @@ from agents_util.agents import (
     ProductQualityCheckAgent,
     OrderIDExtractorAgent,
     ImagePathExtractorAgent,
-    OrderInfoExtractorAgent
+    OrderInfoExtractorAgent,
+    FusedExtractorAgent,
+    ReturnInspectionAgent
 )
+from agents_util.fast_extractors import try_fast_extraction
+from agents_util.stage_executor import LocalTask, execute_with_input_tasks
+from agents_util.local_classifiers import LOCAL_CLASSIFIER_MODE, CLASSIFIER_TASKS, classify_locally
+from agents_util.escalation_rules import get_escalation_mode, evaluate_escalation_rules
 from qdrant_util.qdrant_retriever import (
     retrieve_customer_info, 
     retrieve_customer_helpdesk_logs, 
@@ -35,43 +42,54 @@ load_dotenv()
 
 GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME")
 
-gemini_model = load_gemini_model(model_name=GEMINI_MODEL_NAME)
 qdrant = QdrantClient(host="localhost", port=6333)
 
 # resolved_faq_tags = ['payments']
 # resolved_policy_tags = ['payments']
 # resolved_handbook_tags = ['payments']
 
-def get_image_path_extraction_task(user_input):
+def get_image_path_extraction_task(user_input, use_fast_path=True):
+    if use_fast_path:
+        fast_task = try_fast_extraction("image_path", "ImagePathExtraction", user_input)
+        if fast_task is not None:
+            return fast_task
     task = Task(
         name="ImagePathExtraction",
         agent=ImagePathExtractorAgent,
-        model=gemini_model,
+        model=get_model_for_agent(ImagePathExtractorAgent, GEMINI_MODEL_NAME),
         instructions=user_input,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
     )
     return task
 
-def get_order_id_extraction_task(user_input):
+def get_order_id_extraction_task(user_input, use_fast_path=True):
+    if use_fast_path:
+        fast_task = try_fast_extraction("order_id", "OrderIDExtraction", user_input)
+        if fast_task is not None:
+            return fast_task
     task = Task(
         name="OrderIDExtraction",
         agent=OrderIDExtractorAgent,
-        model=gemini_model,
+        model=get_model_for_agent(OrderIDExtractorAgent, GEMINI_MODEL_NAME),
         instructions=user_input,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
     )
     return task
 
-def get_return_product_validation_task(tenant_id, customer_id, order_id, image_path):
-
-    order_info = retrieve_order_info(
-        client = qdrant,
-        tenant_id = tenant_id,
-        customer_id = customer_id,
-        order_id = order_id
-    )
+def get_return_inspection_context(tenant_id, customer_id, order_id, image_path, order_info=None):
+    """
+    Fetches the original order info and the orders matching the uploaded image once,
+    so the return validation and quality check can share them.
+    """
+    if order_info is None:
+        order_info = retrieve_order_info(
+            client = qdrant,
+            tenant_id = tenant_id,
+            customer_id = customer_id,
+            order_id = order_id
+        )
     retrieved_image_info = retrieve_image_info(
         client = qdrant,
         image_path=image_path,
@@ -90,10 +108,15 @@ Retrieved Image Info
 --------------------
 {retrieved_image_info}
 """
+    return context
+
+def get_return_product_validation_task(tenant_id, customer_id, order_id, image_path, context=None):
+    if context is None:
+        context = get_return_inspection_context(tenant_id, customer_id, order_id, image_path)
     task = Task(
         name="ReturnValidation",
         agent=ReturnValidationAgent,
-        model=gemini_model,
+        model=get_model_for_agent(ReturnValidationAgent, GEMINI_MODEL_NAME),
         instructions=context,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
@@ -101,52 +124,44 @@ Retrieved Image Info
     return task
 
 
-def get_order_info_task(tenant_id, customer_id, order_id):
-    order_info = retrieve_order_info(
-        client = qdrant,
-        tenant_id = tenant_id,
-        customer_id = customer_id,
-        order_id = order_id
-    )
+def get_order_info_task(tenant_id, customer_id, order_id, order_info=None):
+    if order_info is None:
+        order_info = retrieve_order_info(
+            client = qdrant,
+            tenant_id = tenant_id,
+            customer_id = customer_id,
+            order_id = order_id
+        )
     task = Task(
         name="OrderInfoExtraction",
         agent=OrderInfoExtractorAgent,
-        model=gemini_model,
+        model=get_model_for_agent(OrderInfoExtractorAgent, GEMINI_MODEL_NAME),
         instructions=order_info,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
     )
     return task
 
-def get_product_quality_check_task(tenant_id, customer_id, order_id, image_path):
-    order_info = retrieve_order_info(
-        client = qdrant,
-        tenant_id = tenant_id,
-        customer_id = customer_id,
-        order_id = order_id
-    )
-    retrieved_image_info = retrieve_image_info(
-        client = qdrant,
-        image_path=image_path,
-        tenant_id = tenant_id,
-        customer_id = customer_id,
-        top_k=1,
-        k_prefetch=10,
-        query_text=None
-    )
-    context = f"""
-Original Product Info
-----------------------
-{order_info}
-
-Retrieved Image Info
---------------------
-{retrieved_image_info}
-"""
+def get_product_quality_check_task(tenant_id, customer_id, order_id, image_path, context=None):
+    if context is None:
+        context = get_return_inspection_context(tenant_id, customer_id, order_id, image_path)
     task = Task(
         name="ProductQualityChecker",
         agent=ProductQualityCheckAgent,
-        model=gemini_model,
+        model=get_model_for_agent(ProductQualityCheckAgent, GEMINI_MODEL_NAME),
+        instructions=context,
+        input_type=InputType.TEXT,
+        output_type=OutputType.TEXT
+    )
+    return task
+
+def get_return_inspection_task(tenant_id, customer_id, order_id, image_path, context=None):
+    if context is None:
+        context = get_return_inspection_context(tenant_id, customer_id, order_id, image_path)
+    task = Task(
+        name="ReturnInspection",
+        agent=ReturnInspectionAgent,
+        model=get_model_for_agent(ReturnInspectionAgent, GEMINI_MODEL_NAME),
         instructions=context,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
@@ -158,123 +173,156 @@ def get_tenant_identification_task(user_input):
     task = Task(
         name="TenantIdentification",
         agent=TenantResolverAgent,
-        model=gemini_model,
+        model=get_model_for_agent(TenantResolverAgent, GEMINI_MODEL_NAME),
         instructions=user_input,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
     )
     return task
 
-def get_customer_info_extraction_task(user_input, tenant_id, customer_id):
-    context = {
-        "user_query": user_input,
-        "customer_info": retrieve_customer_info(
+def get_customer_info_extraction_task(user_input, tenant_id, customer_id, retrieved_context=None):
+    if retrieved_context is None:
+        retrieved_context = retrieve_customer_info(
             client = qdrant,
             tenant_id = tenant_id,
             customer_id = customer_id,
         )
+    context = {
+        "user_query": user_input,
+        "customer_info": retrieved_context
     }
     task = Task(
         name="CustomerInfoExtraction",
         agent=CustomerInfoExtractorAgent,
-        model=gemini_model,
+        model=get_model_for_agent(CustomerInfoExtractorAgent, GEMINI_MODEL_NAME),
         instructions=context,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
     )
     return task
 
-def get_ticket_extraction_task(user_input, customer_id, tenant_id, top_k=3, k_prefetch=10):
+def get_fused_extraction_task(user_input, customer_info, helpdesk_logs, faqs, policy, handbook):
     context = {
         "user_query": user_input,
-        "helpdesk_logs": retrieve_customer_helpdesk_logs(
+        "customer_info": customer_info,
+        "helpdesk_logs": helpdesk_logs,
+        "faqs": faqs,
+        "policy": policy,
+        "handbook": handbook
+    }
+    task = Task(
+        name="FusedExtraction",
+        agent=FusedExtractorAgent,
+        model=get_model_for_agent(FusedExtractorAgent, GEMINI_MODEL_NAME),
+        instructions=context,
+        input_type=InputType.TEXT,
+        output_type=OutputType.TEXT
+    )
+    return task
+
+def get_ticket_extraction_task(user_input, customer_id, tenant_id, top_k=3, k_prefetch=10, query_embeddings=None, retrieved_context=None):
+    if retrieved_context is None:
+        retrieved_context = retrieve_customer_helpdesk_logs(
             client = qdrant,
             query =  user_input, 
             customer_id = customer_id,
             tenant_id = tenant_id,
             top_k = top_k,
-            k_prefetch = k_prefetch
+            k_prefetch = k_prefetch,
+            query_embeddings = query_embeddings
         )
+    context = {
+        "user_query": user_input,
+        "helpdesk_logs": retrieved_context
     }
     task = Task(
         name="TicketExtraction",
         agent=TicketExtractorAgent,
-        model=gemini_model,
+        model=get_model_for_agent(TicketExtractorAgent, GEMINI_MODEL_NAME),
         instructions=context,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
     )
     return task
 
-def get_faq_extraction_task(user_input, tenant_id, top_k=3, k_prefetch=10, fail_feedback=None):
-    context = {
-        "user_query": user_input,
-        "faqs": retrieve_related_knowledge_base(
+def get_faq_extraction_task(user_input, tenant_id, top_k=3, k_prefetch=10, fail_feedback=None, query_embeddings=None, retrieved_context=None):
+    if retrieved_context is None:
+        retrieved_context = retrieve_related_knowledge_base(
             client = qdrant,
             query =  user_input, 
             source_type = "faqs",
             tenant_id = tenant_id,
             tags = None,
             top_k = top_k,
-            k_prefetch = k_prefetch
+            k_prefetch = k_prefetch,
+            query_embeddings = query_embeddings
         )
+    context = {
+        "user_query": user_input,
+        "faqs": retrieved_context
     }
     if fail_feedback:
         context['error_in_prev_generated_response'] = fail_feedback
     task = Task(
         name="FAQExtraction",
         agent=FAQExtractorAgent,
-        model=gemini_model,
+        model=get_model_for_agent(FAQExtractorAgent, GEMINI_MODEL_NAME),
         instructions=context,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
     )
     return task
 
-def get_handbook_extraction_task(user_input, tenant_id, top_k=3, k_prefetch=10, fail_feedback=None):
-    context = {
-        "user_query": user_input,
-        "handbook": retrieve_related_knowledge_base(
+def get_handbook_extraction_task(user_input, tenant_id, top_k=3, k_prefetch=10, fail_feedback=None, query_embeddings=None, retrieved_context=None):
+    if retrieved_context is None:
+        retrieved_context = retrieve_related_knowledge_base(
             client = qdrant,
             query =  user_input, 
             source_type = "handbook",
             tenant_id = tenant_id,
             tags = None,
             top_k = top_k,
-            k_prefetch = k_prefetch
+            k_prefetch = k_prefetch,
+            query_embeddings = query_embeddings
         )
+    context = {
+        "user_query": user_input,
+        "handbook": retrieved_context
     }
     if fail_feedback:
         context['error_in_prev_generated_response'] = fail_feedback
     task = Task(
         name="HandbookExtraction",
         agent=HandbookExtractorAgent,
-        model=gemini_model,
+        model=get_model_for_agent(HandbookExtractorAgent, GEMINI_MODEL_NAME),
         instructions=context,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
     )
     return task
 
-def get_policy_extraction_task(user_input, tenant_id, top_k=3, k_prefetch=10, fail_feedback=None):
-    context = {
-        "user_query": user_input,
-        "policy": retrieve_related_knowledge_base(
+def get_policy_extraction_task(user_input, tenant_id, top_k=3, k_prefetch=10, fail_feedback=None, query_embeddings=None, retrieved_context=None):
+    if retrieved_context is None:
+        retrieved_context = retrieve_related_knowledge_base(
             client = qdrant,
             query =  user_input, 
             source_type = "policy",
             tenant_id = tenant_id,
             tags = None,
             top_k = top_k,
-            k_prefetch = k_prefetch
+            k_prefetch = k_prefetch,
+            query_embeddings = query_embeddings
         )
+    context = {
+        "user_query": user_input,
+        "policy": retrieved_context
     }
     if fail_feedback:
         context['error_in_prev_generated_response'] = fail_feedback
     task = Task(
         name="PolicyExtraction",
         agent=PolicyExtractorAgent,
-        model=gemini_model,
+        model=get_model_for_agent(PolicyExtractorAgent, GEMINI_MODEL_NAME),
         instructions=context,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
@@ -283,11 +331,27 @@ def get_policy_extraction_task(user_input, tenant_id, top_k=3, k_prefetch=10, fa
 
 
 
-def get_routing_task(user_input):
+def get_local_classification_task(kind, user_input, query_embeddings=None):
+    """Returns a LocalTask with the local classifier's label, or None when the LLM should be used."""
+    if LOCAL_CLASSIFIER_MODE != "local":
+        return None
+    label = classify_locally(kind, user_input, query_embeddings)
+    if label is None:
+        return None
+    task_config = CLASSIFIER_TASKS[kind]
+    return LocalTask(
+        task_config["task_name"], task_config["agent_name"],
+        lambda: {task_config["field"]: label, "concise_reason": "Classified by the local embedding classifier."}
+    )
+
+def get_routing_task(user_input, query_embeddings=None):
+    local_task = get_local_classification_task("routing", user_input, query_embeddings)
+    if local_task is not None:
+        return local_task
     route_task = Task(
         name="RouteIssue",
         agent=RouterAgent,
-        model=gemini_model,
+        model=get_model_for_agent(RouterAgent, GEMINI_MODEL_NAME),
         instructions=user_input,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
@@ -295,11 +359,14 @@ def get_routing_task(user_input):
     return route_task
 
 
-def get_sentiment_analysis_task(user_input):
+def get_sentiment_analysis_task(user_input, query_embeddings=None):
+    local_task = get_local_classification_task("sentiment", user_input, query_embeddings)
+    if local_task is not None:
+        return local_task
     senti_task = Task(
         name="AnalyzeSentiment",
         agent=SentimentAgent,
-        model=gemini_model,
+        model=get_model_for_agent(SentimentAgent, GEMINI_MODEL_NAME),
         instructions=user_input,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT
@@ -307,11 +374,11 @@ def get_sentiment_analysis_task(user_input):
     return senti_task
 
 
-def get_escalation_task(user_input, route_task, senti_task):
+def get_escalation_task(user_input, route_task, senti_task, tenant_id=None):
     escalation_task = Task(
         name="CheckEscalation",
         agent=EscalationAgent,
-        model=gemini_model,
+        model=get_model_for_agent(EscalationAgent, GEMINI_MODEL_NAME),
         instructions=user_input,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT,
@@ -320,7 +387,23 @@ def get_escalation_task(user_input, route_task, senti_task):
             senti_task
         ]
     )
-    return escalation_task
+    if get_escalation_mode(tenant_id) != "rules":
+        return escalation_task
+
+    def decide_escalation():
+        try:
+            return evaluate_escalation_rules(tenant_id, route_task.output, senti_task.output)
+        except ValueError:
+            # fall back to the agent when routing/sentiment outputs can't be parsed
+            return text_2_json(execute_with_input_tasks(escalation_task))['response']
+
+    return LocalTask(
+        "CheckEscalation", "Escalation", decide_escalation,
+        input_tasks = [
+            route_task,
+            senti_task
+        ]
+    )
 
 def get_response_task(full_context, history, route_task, senti_task, escalation_task):
     resp_instructions = (
@@ -334,7 +417,7 @@ def get_response_task(full_context, history, route_task, senti_task, escalation_
     response_task = Task(
         name="GenerateResponse",
         agent=ResponseAgent, 
-        model=gemini_model,
+        model=get_model_for_agent(ResponseAgent, GEMINI_MODEL_NAME),
         instructions=resp_instructions,
         input_type=InputType.TEXT,
         output_type=OutputType.TEXT,
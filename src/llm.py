@@ -1,35 +1,187 @@
 import os
+import json
+import time
+import sqlite3
+import hashlib
+import random
+import asyncio
+import threading
 from dotenv import load_dotenv
 from lyzr_automata.ai_models.model_base import AIModel
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from utils import text_2_json
 
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=GEMINI_API_KEY)
 
+# errors worth retrying: rate limits, timeouts and transient server failures
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+
+
+class GeminiTransport:
+    """Sends prompts to Gemini. Swap it for a FakeTransport in tests."""
+    def __init__(self, model_name):
+        self.model = genai.GenerativeModel(model_name=model_name)
+
+    def generate(self, prompt, timeout=None):
+        request_options = {"timeout": timeout} if timeout else None
+        return self.model.generate_content(prompt, request_options=request_options).text
+
+    async def agenerate(self, prompt, timeout=None):
+        request_options = {"timeout": timeout} if timeout else None
+        response = await self.model.generate_content_async(prompt, request_options=request_options)
+        return response.text
+
+    def stream(self, prompt, timeout=None):
+        request_options = {"timeout": timeout} if timeout else None
+        for chunk in self.model.generate_content(prompt, stream=True, request_options=request_options):
+            yield chunk.text
+
+
+class FakeTransport:
+    """
+    Returns canned responses instead of calling Gemini.
+    `responses` is a list consumed in order (exceptions in it are raised) or a callable taking the prompt.
+    """
+    def __init__(self, responses):
+        self.responses = responses
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, timeout=None):
+        with self._lock:
+            self.prompts.append(prompt)
+            response = self.responses(prompt) if callable(self.responses) else self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def agenerate(self, prompt, timeout=None):
+        return self.generate(prompt, timeout)
+
+    def stream(self, prompt, timeout=None, chunk_size=8):
+        response = self.generate(prompt, timeout)
+        for i in range(0, len(response), chunk_size):
+            yield response[i:i + chunk_size]
+
+
 class GeminiModel(AIModel):
-    def __init__(self, api_key=None, parameters=None):
+    def __init__(self, api_key=None, parameters=None, transport=None):
         self.api_key = api_key
         self.parameters = parameters or {}
 
-        self.model = genai.GenerativeModel(
-        model_name=self.parameters.get("model", "gemini-1.5-flash"),
-        # system_instruction="You are a helpful assistant for geophysics researchers.",
-        )
+        self.transport = transport or GeminiTransport(self.parameters.get("model", "gemini-1.5-flash"))
+        self.max_in_flight = self.parameters.get("max_in_flight", 8)
+        self.max_retries = self.parameters.get("max_retries", 4)
+        self.initial_backoff = self.parameters.get("initial_backoff", 1.0)
+        self.max_backoff = self.parameters.get("max_backoff", 30.0)
+        self.timeout = self.parameters.get("timeout", 60)
 
-    def generate_text(self, task_id=None, system_persona=None, prompt=None):
-        """
-        Required abstract method implementation for text generation
-        """
+        # limits concurrent requests across all threads sharing this model
+        self._semaphore = threading.BoundedSemaphore(self.max_in_flight)
+        # asyncio semaphores are bound to an event loop, so keep one per loop
+        self._async_semaphores = {}
+        self.stats = {"calls": 0, "retries": 0, "failures": 0}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _get_async_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_semaphores:
+            self._async_semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        return self._async_semaphores[loop]
+
+    def _backoff(self, attempt):
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.max_backoff, self.initial_backoff * 2 ** attempt))
+
+    @staticmethod
+    def _build_prompt(system_persona=None, prompt=None):
         # Combine system persona and prompt if both are provided
         full_prompt = prompt
         if system_persona and prompt:
             full_prompt = f"{system_persona}\n\n{prompt}"
         elif system_persona:
             full_prompt = system_persona
-        outputs = self.model.generate_content(full_prompt).text
-        return outputs
+        return full_prompt
+
+    def generate_text(self, task_id=None, system_persona=None, prompt=None):
+        """
+        Required abstract method implementation for text generation
+        """
+        full_prompt = self._build_prompt(system_persona, prompt)
+        self._record("calls")
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._semaphore:
+                    return self.transport.generate(full_prompt, timeout=self.timeout)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self._record("failures")
+                    raise
+                self._record("retries")
+                delay = self._backoff(attempt)
+                print(f"Gemini call failed with {type(e).__name__}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    async def agenerate_text(self, task_id=None, system_persona=None, prompt=None):
+        """
+        Async counterpart of generate_text
+        """
+        full_prompt = self._build_prompt(system_persona, prompt)
+        self._record("calls")
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._get_async_semaphore():
+                    return await asyncio.wait_for(
+                        self.transport.agenerate(full_prompt, timeout=self.timeout), timeout=self.timeout
+                    )
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self._record("failures")
+                    raise
+                self._record("retries")
+                delay = self._backoff(attempt)
+                print(f"Gemini call failed with {type(e).__name__}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def stream_text(self, task_id=None, system_persona=None, prompt=None):
+        """
+        Yields the generated text chunk by chunk as it arrives.
+        Errors are only retried until the first chunk has been received.
+        """
+        full_prompt = self._build_prompt(system_persona, prompt)
+        self._record("calls")
+        for attempt in range(self.max_retries + 1):
+            received_chunk = False
+            try:
+                with self._semaphore:
+                    for chunk in self.transport.stream(full_prompt, timeout=self.timeout):
+                        received_chunk = True
+                        yield chunk
+                return
+            except RETRYABLE_ERRORS as e:
+                if received_chunk or attempt == self.max_retries:
+                    self._record("failures")
+                    raise
+                self._record("retries")
+                delay = self._backoff(attempt)
+                print(f"Gemini stream failed with {type(e).__name__}, retrying in {delay:.2f}s")
+                time.sleep(delay)
 
     def generate_image(self, task_id=None, prompt=None, resource_box=None, tasks=None):
         """
@@ -46,14 +198,210 @@ class GeminiModel(AIModel):
         return self.generate_text(prompt=prompt)
 
 
-def load_gemini_model(model_name="gemini-2.0-flash"):
-    parameters = {
-            "model": model_name,
+# parameters that change how a request is sent, not what the model answers
+TRANSPORT_PARAMETERS = ("max_in_flight", "max_retries", "initial_backoff", "max_backoff", "timeout")
+
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE_ENABLED", "false").lower() == "true"
+COMPLETION_CACHE_PATH = os.getenv("COMPLETION_CACHE_PATH", "data/llm_cache/completions.sqlite")
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", 20000))
+COMPLETION_CACHE_MAX_MB = float(os.getenv("COMPLETION_CACHE_MAX_MB", 64))
+# roles of the agents whose answers only depend on their input, comma separated
+COMPLETION_CACHE_AGENTS = [
+    role.strip() for role in os.getenv(
+        "COMPLETION_CACHE_AGENTS", "TenantResolver,OrderIDExtractor,ImagePathExtractor,Router,SentimentAnalyzer"
+    ).split(",") if role.strip()
+]
+
+
+class CompletionCache:
+    """
+    SQLite-backed completion store that survives process restarts.
+    The least recently used completions are evicted once it holds more than `max_entries`
+    entries or `max_mb` megabytes of responses.
+    """
+    def __init__(self, path: str = COMPLETION_CACHE_PATH, max_entries: int = 20000, max_mb: float = 64):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, response TEXT, size INTEGER, created_at REAL, last_hit_at REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS completions_last_hit_at ON completions (last_hit_at)")
+        self._connection.commit()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "inserts": 0, "evictions": 0, "rejected": 0}
+
+    @staticmethod
+    def make_key(model_name, system_persona, prompt, parameters):
+        payload = json.dumps([model_name, system_persona, prompt, parameters], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._connection.execute("UPDATE completions SET last_hit_at = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+            self.stats["hits"] += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (key, response, size, created_at, last_hit_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self.stats["inserts"] += 1
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        count, total_size = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        while count > self.max_entries or total_size > self.max_bytes:
+            key, size = self._connection.execute(
+                "SELECT key, size FROM completions ORDER BY last_hit_at LIMIT 1"
+            ).fetchone()
+            self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+            count, total_size = count - 1, total_size - size
+            self.stats["evictions"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            count, total_size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+            ).fetchone()
+        return {"size": count, "bytes": total_size, **self.stats}
+
+
+def is_json_response(response):
+    """True if `response` parses into the {"response": ...} object every agent is prompted to answer with."""
+    try:
+        parsed = text_2_json(response)
+    except (ValueError, TypeError):
+        return False
+    return isinstance(parsed, dict) and "response" in parsed
+
+
+class CachedGeminiModel(AIModel):
+    """
+    Serves repeated prompts of one agent from a CompletionCache and sends the rest to `model`.
+    Only use it for agents whose output is fully determined by their prompt.
+    Responses rejected by `validator` (truncated or malformed output) are returned but not cached.
+    """
+    def __init__(self, model: GeminiModel, completion_cache: CompletionCache, validator=is_json_response):
+        self.model = model
+        self.completion_cache = completion_cache
+        self.validator = validator
+        self.parameters = {
+            k: v for k, v in model.parameters.items() if k not in TRANSPORT_PARAMETERS
         }
 
-    gemini_model = GeminiModel(
-        api_key=GEMINI_API_KEY,
-        parameters=parameters
-    )
+    def _key(self, system_persona, prompt):
+        return self.completion_cache.make_key(self.parameters.get("model"), system_persona, prompt, self.parameters)
+
+    def _put(self, key, response):
+        if self.validator is not None and not self.validator(response):
+            # a bad completion would otherwise be replayed for this prompt until evicted
+            self.completion_cache.stats["rejected"] += 1
+            return
+        self.completion_cache.put(key, response)
+
+    def generate_text(self, task_id=None, system_persona=None, prompt=None):
+        key = self._key(system_persona, prompt)
+        response = self.completion_cache.get(key)
+        if response is None:
+            response = self.model.generate_text(task_id=task_id, system_persona=system_persona, prompt=prompt)
+            self._put(key, response)
+        return response
+
+    async def agenerate_text(self, task_id=None, system_persona=None, prompt=None):
+        key = self._key(system_persona, prompt)
+        response = self.completion_cache.get(key)
+        if response is None:
+            response = await self.model.agenerate_text(task_id=task_id, system_persona=system_persona, prompt=prompt)
+            self._put(key, response)
+        return response
+
+    def stream_text(self, task_id=None, system_persona=None, prompt=None):
+        key = self._key(system_persona, prompt)
+        response = self.completion_cache.get(key)
+        if response is not None:
+            yield response
+            return
+        chunks = []
+        for chunk in self.model.stream_text(task_id=task_id, system_persona=system_persona, prompt=prompt):
+            chunks.append(chunk)
+            yield chunk
+        self._put(key, "".join(chunks))
+
+    def generate_image(self, task_id=None, prompt=None, resource_box=None, tasks=None):
+        return self.model.generate_image(task_id=task_id, prompt=prompt, resource_box=resource_box, tasks=tasks)
+
+
+# one model (and client) per model name, shared by every task and session in the process
+_shared_models = {}
+_shared_models_lock = threading.Lock()
+
+
+def load_gemini_model(model_name="gemini-2.0-flash", transport=None, **parameters):
+    model_name = model_name or "gemini-2.0-flash"
+    with _shared_models_lock:
+        if transport is None and model_name in _shared_models:
+            return _shared_models[model_name]
+
+        parameters = {
+                "model": model_name,
+                "max_in_flight": int(os.getenv("GEMINI_MAX_IN_FLIGHT", 8)),
+                "max_retries": int(os.getenv("GEMINI_MAX_RETRIES", 4)),
+                "timeout": float(os.getenv("GEMINI_TIMEOUT", 60)),
+                **parameters,
+            }
+
+        gemini_model = GeminiModel(
+            api_key=GEMINI_API_KEY,
+            parameters=parameters,
+            transport=transport
+        )
+        if transport is None:
+            _shared_models[model_name] = gemini_model
+
+    return gemini_model
+
+
+_completion_cache = None
+_cached_models = {}
+
+
+def get_completion_cache():
+    global _completion_cache
+    with _shared_models_lock:
+        if _completion_cache is None:
+            _completion_cache = CompletionCache(
+                COMPLETION_CACHE_PATH,
+                max_entries=COMPLETION_CACHE_MAX_ENTRIES,
+                max_mb=COMPLETION_CACHE_MAX_MB,
+            )
+    return _completion_cache
+
+
+def get_model_for_agent(agent, model_name="gemini-2.0-flash"):
+    """
+    Returns the shared model for `agent`, wrapped in the completion cache when the cache is
+    enabled (COMPLETION_CACHE_ENABLED) and the agent's role is listed in COMPLETION_CACHE_AGENTS.
+    """
+    gemini_model = load_gemini_model(model_name)
+    if not COMPLETION_CACHE_ENABLED or agent.role not in COMPLETION_CACHE_AGENTS:
+        return gemini_model
 
-    return gemini_model
\ No newline at end of file
+    model_name = model_name or "gemini-2.0-flash"
+    completion_cache = get_completion_cache()
+    with _shared_models_lock:
+        if model_name not in _cached_models:
+            _cached_models[model_name] = CachedGeminiModel(gemini_model, completion_cache)
+    return _cached_models[model_name]
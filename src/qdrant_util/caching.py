@@ -1,24 +1,141 @@
+import re
 import uuid
 import time
+import threading
+from collections import OrderedDict
 from qdrant_client import QdrantClient, models
-from fastembed import TextEmbedding
 from qdrant_client.models import PointStruct, NamedVector
+from qdrant_util.query_embedding import QueryEmbeddings
+from qdrant_util.embedding_models import get_dense_embedding_model
 
-DENSE_EMBEDDING_MODEL_NAME = "BAAI/bge-small-en-v1.5"
-DENSE_EMBEDDING_MODEL = TextEmbedding(model_name=DENSE_EMBEDDING_MODEL_NAME)
 client = QdrantClient(host="localhost", port=6333)
 
+
+def normalize_query(query_text: str):
+    """Lowercases, collapses whitespace and strips trailing punctuation so trivial variations share a key."""
+    return re.sub(r"\s+", " ", query_text.lower()).strip().rstrip("?!. ")
+
+
+class ExactMatchCache:
+    """
+    In-process LRU with TTL keyed on the normalized query, tenant and customer.
+    Each entry remembers the id of the L2 point it mirrors, so L1 hits can be counted in L2.
+    """
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 24 * 60 * 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, query_text: str, tenant_id: str, customer_id: str):
+        return (normalize_query(query_text), tenant_id, customer_id)
+
+    def get(self, query_text: str, tenant_id: str, customer_id: str):
+        key = self._key(query_text, tenant_id, customer_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            response, expires_at, point_id = entry
+            if expires_at is not None and time.time() > expires_at:
+                del self._entries[key]
+                return None, None
+            self._entries.move_to_end(key)
+            return response, point_id
+
+    def put(self, query_text: str, tenant_id: str, customer_id: str, response: str, expires_at: float = None, point_id: str = None):
+        if self.max_entries <= 0:
+            return
+        if expires_at is None and self.ttl_seconds:
+            expires_at = time.time() + self.ttl_seconds
+        key = self._key(query_text, tenant_id, customer_id)
+        with self._lock:
+            self._entries[key] = (response, expires_at, point_id)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class SemanticCache:
-    def __init__(self, threshold: float = 0.2):
+    def __init__(
+        self,
+        threshold: float = 0.2,
+        ttl_seconds: float = 24 * 60 * 60,
+        max_entries_per_customer: int = 100,
+        eviction_policy: str = "lru",
+        sweep_interval_seconds: float = 300,
+        l1_max_entries: int = 1024,
+        write_behind: bool = False,
+        write_batch_size: int = 32,
+        write_flush_interval_seconds: float = 1.0,
+    ):
+        if eviction_policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown eviction policy: {eviction_policy}. Expected 'lru' or 'lfu'.")
         self.client = client
-        self.embedding_model = DENSE_EMBEDDING_MODEL
         self.collection_name = "semantic_cache"
-        self.threshold = threshold 
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_customer = max_entries_per_customer
+        self.eviction_policy = eviction_policy
+        self.sweep_interval_seconds = sweep_interval_seconds
+        # exact repeats are answered from memory before embedding the query or searching Qdrant (L2)
+        self.l1 = ExactMatchCache(max_entries=l1_max_entries, ttl_seconds=ttl_seconds)
+
+        # (tenant_id, customer_id) pairs that got new entries since the last sweep
+        self._dirty_keys = set()
+        # point id -> (L1 hits, last hit time) not yet written to L2, so its LRU/LFU eviction sees them
+        self._pending_hits = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stop_sweeper = threading.Event()
+
+        self.write_behind = write_behind
+        self.write_batch_size = write_batch_size
+        self.write_flush_interval_seconds = write_flush_interval_seconds
+        # (normalized query, tenant_id, customer_id) -> entry waiting to be written
+        self._pending_writes = {}
+        self._flush_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._stop_writer = threading.Event()
+        self._writer = None
+        if write_behind:
+            self._writer = threading.Thread(target=self._write_behind_forever, name="semantic-cache-writer", daemon=True)
+            self._writer.start()
+        self.metrics = {"l1_hits": 0, "hits": 0, "misses": 0, "inserts": 0, "expired_evictions": 0, "capacity_evictions": 0, "sweeps": 0, "write_behind_batches": 0, "write_behind_deduped": 0, "l1_hits_recorded": 0}
+
+    def _tenant_customer_conditions(self, tenant_id: str, customer_id: str):
+        return [
+            models.FieldCondition(key="tenant_id", match=models.MatchValue(value=tenant_id)),
+            models.FieldCondition(key="customer_id", match=models.MatchValue(value=customer_id))
+        ]
+
+    def _not_expired_condition(self):
+        return models.FieldCondition(key="created_at", range=models.Range(gte=time.time() - self.ttl_seconds))
 
-    def check_cache(self, query_text: str, tenant_id: str, customer_id: str):
+    def check_cache(self, query_text: str, tenant_id: str, customer_id: str, query_embeddings: QueryEmbeddings = None):
         """Checks the cache for a semantically similar query."""
         start_time = time.time()
-        query_vector = list(self.embedding_model.embed([query_text]))[0]
+        l1_response, point_id = self.l1.get(query_text, tenant_id, customer_id)
+        if l1_response is not None:
+            print(f"L1 CACHE HIT! (Time: {time.time() - start_time:.6f}s)")
+            self.metrics["l1_hits"] += 1
+            if point_id is not None:
+                with self._lock:
+                    hits, _ = self._pending_hits.get(str(point_id), (0, 0))
+                    self._pending_hits[str(point_id)] = (hits + 1, time.time())
+            return l1_response
+
+        if query_embeddings is None:
+            query_embeddings = QueryEmbeddings(query_text)
+        query_vector = query_embeddings.dense
+
+        must_clauses = self._tenant_customer_conditions(tenant_id, customer_id)
+        if self.ttl_seconds:
+            # expired entries are never served, even before the sweeper removes them
+            must_clauses.append(self._not_expired_condition())
 
         search_result = self.client.search(
             collection_name=self.collection_name,
@@ -26,29 +143,79 @@ class SemanticCache:
                 name="dense",
                 vector=query_vector
             ),
-            query_filter=models.Filter(
-                must=[
-                    models.FieldCondition(key="tenant_id", match=models.MatchValue(value=tenant_id)),
-                    models.FieldCondition(key="customer_id", match=models.MatchValue(value=customer_id))
-                ]
-            ),
+            query_filter=models.Filter(must=must_clauses),
             limit=1,
             with_payload=True
         )
         if search_result and search_result[0].score <= self.threshold:
             end_time = time.time()
             print(f"CACHE HIT! (Score: {search_result[0].score:.4f}, Time: {end_time - start_time:.4f}s)")
-            return search_result[0].payload.get("response")
-        
+            self.metrics["hits"] += 1
+            self._record_hit(search_result[0])
+            response = search_result[0].payload.get("response")
+            # the L1 entry must not outlive the L2 entry it was copied from
+            expires_at = None
+            if self.ttl_seconds:
+                expires_at = search_result[0].payload.get("created_at", time.time()) + self.ttl_seconds
+            self.l1.put(query_text, tenant_id, customer_id, response, expires_at=expires_at, point_id=search_result[0].id)
+            return response
+
         print("CACHE MISS!")
+        self.metrics["misses"] += 1
         return None
 
-    def add_to_cache(self, query_text: str, response_text: str, tenant_id: str, customer_id: str):
-        """Adds a new query-response pair to the cache."""
-        query_vector = list(self.embedding_model.embed([query_text]))[0]
+    def _record_hit(self, point):
+        # used by the LRU/LFU eviction, no need to wait for it
+        self.client.set_payload(
+            collection_name=self.collection_name,
+            payload={
+                "last_hit_at": time.time(),
+                "hit_count": point.payload.get("hit_count", 0) + 1,
+            },
+            points=[point.id],
+            wait=False
+        )
+
+    def flush_hits(self):
+        """Adds the buffered L1 hits to the hit_count and last_hit_at of their L2 points."""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        if not pending:
+            return 0
+        try:
+            # points evicted in the meantime are simply not returned
+            points = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=list(pending),
+                with_payload=["hit_count", "last_hit_at"],
+                with_vectors=False,
+            )
+            operations = []
+            for point in points:
+                hits, last_hit_at = pending[str(point.id)]
+                operations.append(models.SetPayloadOperation(set_payload=models.SetPayload(
+                    payload={
+                        "hit_count": point.payload.get("hit_count", 0) + hits,
+                        "last_hit_at": max(last_hit_at, point.payload.get("last_hit_at", 0)),
+                    },
+                    points=[point.id],
+                )))
+            if operations:
+                self.client.batch_update_points(collection_name=self.collection_name, update_operations=operations, wait=True)
+        except Exception:
+            # keep the hits for the next flush
+            with self._lock:
+                for point_id, (hits, last_hit_at) in pending.items():
+                    buffered_hits, buffered_last_hit_at = self._pending_hits.get(point_id, (0, 0))
+                    self._pending_hits[point_id] = (hits + buffered_hits, max(last_hit_at, buffered_last_hit_at))
+            raise
+        self.metrics["l1_hits_recorded"] += sum(hits for hits, _ in pending.values())
+        return len(operations)
 
-        points=PointStruct(
-            id=str(uuid.uuid4()),
+    def _build_point(self, query_vector, response_text: str, tenant_id: str, customer_id: str, point_id: str = None):
+        now = time.time()
+        return PointStruct(
+            id=point_id or str(uuid.uuid4()),
             vector={
                 "dense": query_vector,
             },
@@ -56,12 +223,196 @@ class SemanticCache:
                 'response': response_text,
                 'tenant_id': tenant_id,
                 'customer_id': customer_id,
+                'created_at': now,
+                'last_hit_at': now,
+                'hit_count': 0,
             },
         )
-        
+
+    def add_to_cache(self, query_text: str, response_text: str, tenant_id: str, customer_id: str, query_embeddings: QueryEmbeddings = None):
+        """Adds a new query-response pair to the cache."""
+        # chosen up front so L1 hits on the entry can be counted in L2 once it is written
+        point_id = str(uuid.uuid4())
+        self.l1.put(query_text, tenant_id, customer_id, response_text, point_id=point_id)
+        with self._lock:
+            self._dirty_keys.add((tenant_id, customer_id))
+
+        if self.write_behind:
+            # embedding and upsert happen on the background writer, off the response path.
+            # a newer answer for the same normalized query replaces the pending one
+            with self._lock:
+                key = (normalize_query(query_text), tenant_id, customer_id)
+                if key in self._pending_writes:
+                    self.metrics["write_behind_deduped"] += 1
+                self._pending_writes[key] = (
+                    query_text, response_text, tenant_id, customer_id, query_embeddings, point_id
+                )
+                pending = len(self._pending_writes)
+            if pending >= self.write_batch_size:
+                self._flush_requested.set()
+            return
+
+        if query_embeddings is None:
+            query_embeddings = QueryEmbeddings(query_text)
+        points = self._build_point(query_embeddings.dense, response_text, tenant_id, customer_id, point_id)
+
         self.client.upsert(
             collection_name=self.collection_name,
             points=[points],
             wait=True
         )
-        print("Added new entry to semantic cache.")
\ No newline at end of file
+        self.metrics["inserts"] += 1
+        print("Added new entry to semantic cache.")
+
+    def flush(self):
+        """Embeds and upserts every pending write-behind entry in batches."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending_writes = list(self._pending_writes.items()), {}
+
+            for i in range(0, len(pending), self.write_batch_size):
+                try:
+                    self._upsert_pending_batch([entry for _, entry in pending[i:i + self.write_batch_size]])
+                except Exception:
+                    # put the unsent entries back for the next flush; a newer answer queued meanwhile wins
+                    with self._lock:
+                        for key, entry in pending[i:]:
+                            self._pending_writes.setdefault(key, entry)
+                    raise
+
+    def _upsert_pending_batch(self, batch):
+        # queries whose embedding wasn't computed during the turn are embedded together
+        missing_texts = [query_text for query_text, _, _, _, query_embeddings, _ in batch if query_embeddings is None]
+        missing_vectors = iter(list(get_dense_embedding_model().embed(missing_texts)) if missing_texts else [])
+
+        points = []
+        for query_text, response_text, tenant_id, customer_id, query_embeddings, point_id in batch:
+            query_vector = query_embeddings.dense if query_embeddings is not None else next(missing_vectors)
+            points.append(self._build_point(query_vector, response_text, tenant_id, customer_id, point_id))
+
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=points,
+            wait=False
+        )
+        self.metrics["inserts"] += len(points)
+        self.metrics["write_behind_batches"] += 1
+
+    def _write_behind_forever(self):
+        while not self._stop_writer.is_set():
+            self._flush_requested.wait(self.write_flush_interval_seconds)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Semantic cache write-behind flush failed: {e}")
+
+    def close(self):
+        """Stops the background threads, flushing pending write-behind entries first."""
+        if self._writer is not None:
+            self._stop_writer.set()
+            self._flush_requested.set()
+            self._writer.join()
+            self._writer = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Semantic cache write-behind flush failed, {len(self._pending_writes)} entries were not written: {e}")
+        try:
+            self.flush_hits()
+        except Exception as e:
+            print(f"Semantic cache L1 hit flush failed: {e}")
+        self.stop_sweeper()
+
+    def evict_expired(self):
+        """Deletes every entry older than the TTL, and entries written before created_at existed."""
+        if not self.ttl_seconds:
+            return 0
+        expired_filter = models.Filter(
+            should=[
+                models.FieldCondition(key="created_at", range=models.Range(lt=time.time() - self.ttl_seconds)),
+                # never served by the TTL filter of check_cache, so they would only take up space
+                models.IsEmptyCondition(is_empty=models.PayloadField(key="created_at")),
+            ]
+        )
+        expired = self.client.count(collection_name=self.collection_name, count_filter=expired_filter, exact=True).count
+        if expired:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.FilterSelector(filter=expired_filter),
+                wait=True
+            )
+            self.metrics["expired_evictions"] += expired
+        return expired
+
+    def enforce_capacity(self, tenant_id: str, customer_id: str):
+        """Evicts the least recently (lru) or least frequently (lfu) hit entries above the per-customer cap."""
+        customer_filter = models.Filter(must=self._tenant_customer_conditions(tenant_id, customer_id))
+        size = self.client.count(collection_name=self.collection_name, count_filter=customer_filter, exact=True).count
+        excess = size - self.max_entries_per_customer
+        if excess <= 0:
+            return 0
+
+        entries = []
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=customer_filter,
+                limit=256,
+                offset=offset,
+                with_payload=["last_hit_at", "hit_count"],
+                with_vectors=False,
+            )
+            entries.extend(points)
+            if offset is None:
+                break
+
+        if self.eviction_policy == "lfu":
+            sort_key = lambda point: (point.payload.get("hit_count", 0), point.payload.get("last_hit_at", 0))
+        else:
+            sort_key = lambda point: point.payload.get("last_hit_at", 0)
+        victims = [point.id for point in sorted(entries, key=sort_key)[:excess]]
+
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.PointIdsList(points=victims),
+            wait=True
+        )
+        self.metrics["capacity_evictions"] += len(victims)
+        return len(victims)
+
+    def sweep(self):
+        """Runs one eviction pass: TTL for the whole cache, capacity for the customers written to since the last pass."""
+        with self._lock:
+            dirty_keys, self._dirty_keys = self._dirty_keys, set()
+        # hits served from L1 must count before choosing what to evict
+        self.flush_hits()
+        self.evict_expired()
+        for tenant_id, customer_id in dirty_keys:
+            self.enforce_capacity(tenant_id, customer_id)
+        self.metrics["sweeps"] += 1
+
+    def _sweep_forever(self):
+        while not self._stop_sweeper.wait(self.sweep_interval_seconds):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Semantic cache sweep failed: {e}")
+
+    def start_sweeper(self):
+        """Starts the background thread that periodically runs `sweep`."""
+        if self._sweeper is None or not self._sweeper.is_alive():
+            self._stop_sweeper.clear()
+            self._sweeper = threading.Thread(target=self._sweep_forever, name="semantic-cache-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop_sweeper.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+
+    def get_metrics(self):
+        """Returns hit/miss/eviction counters and the current number of cached entries."""
+        size = self.client.count(collection_name=self.collection_name, exact=True).count
+        return {"size": size, "l1_size": len(self.l1), "pending_writes": len(self._pending_writes), **self.metrics}
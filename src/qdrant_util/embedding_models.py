@@ -0,0 +1,82 @@
+import time
+import threading
+import resource
+from fastembed import SparseTextEmbedding, TextEmbedding, ImageEmbedding
+
+DENSE_EMBEDDING_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+SPARSE_EMBEDDING_MODEL_NAME = "prithivida/Splade_PP_en_v1"
+IMAGE_EMBEDDING_MODEL_NAME = "Qdrant/clip-ViT-B-32-vision"
+# text tower of the same CLIP model, embeds text queries into the image vector space
+IMAGE_TEXT_EMBEDDING_MODEL_NAME = "Qdrant/clip-ViT-B-32-text"
+
+# One fastembed instance (and ONNX session) per model for the whole process.
+# Models are only loaded the first time they are requested.
+_MODEL_FACTORIES = {
+    "dense": (TextEmbedding, DENSE_EMBEDDING_MODEL_NAME),
+    "sparse": (SparseTextEmbedding, SPARSE_EMBEDDING_MODEL_NAME),
+    "image": (ImageEmbedding, IMAGE_EMBEDDING_MODEL_NAME),
+    "image_text": (TextEmbedding, IMAGE_TEXT_EMBEDDING_MODEL_NAME),
+}
+_models = {}
+_model_stats = {}
+_lock = threading.Lock()
+
+
+def _get_rss_mb():
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_embedding_model(kind: str):
+    """Returns the shared embedding model of the given kind (dense, sparse, image or image_text), loading it on first use."""
+    model = _models.get(kind)
+    if model is not None:
+        return model
+
+    if kind not in _MODEL_FACTORIES:
+        raise ValueError(f"Unknown embedding model kind: {kind}. Expected one of {list(_MODEL_FACTORIES)}")
+
+    with _lock:
+        # another thread may have loaded it while we were waiting
+        if kind in _models:
+            return _models[kind]
+
+        model_cls, model_name = _MODEL_FACTORIES[kind]
+        rss_before = _get_rss_mb()
+        start_time = time.time()
+        model = model_cls(model_name=model_name)
+        load_time = time.time() - start_time
+
+        _model_stats[kind] = {
+            "model_name": model_name,
+            "load_time_s": round(load_time, 4),
+            "peak_rss_increase_mb": round(_get_rss_mb() - rss_before, 2),
+        }
+        _models[kind] = model
+        print(f"Loaded {kind} embedding model '{model_name}' in {load_time:.4f}s")
+    return model
+
+
+def get_dense_embedding_model():
+    return get_embedding_model("dense")
+
+
+def get_sparse_embedding_model():
+    return get_embedding_model("sparse")
+
+
+def get_image_embedding_model():
+    return get_embedding_model("image")
+
+
+def get_image_text_embedding_model():
+    return get_embedding_model("image_text")
+
+
+def get_embedding_model_stats():
+    """Returns load time and memory stats of every model loaded so far."""
+    return {
+        "loaded_models": list(_models),
+        "models": dict(_model_stats),
+        "process_peak_rss_mb": round(_get_rss_mb(), 2),
+    }
@@ -1,163 +1,498 @@
 import os
+import sys
+import time
 import uuid
 import json
+import hashlib
+import argparse
 import pandas as pd
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from qdrant_client import QdrantClient
 from tqdm import tqdm
-from qdrant_client.models import PointStruct, SparseVector
-from fastembed import SparseTextEmbedding, TextEmbedding, ImageEmbedding
-
-DENSE_EMBEDDING_MODEL_NAME = "BAAI/bge-small-en-v1.5"
-SPARSE_EMBEDDING_MODEL_NAME = "prithivida/Splade_PP_en_v1"
-IMAGE_EMBEDDING_MODEL_NAME = "Qdrant/clip-ViT-B-32-vision"
-DENSE_EMBEDDING_MODEL = TextEmbedding(model_name=DENSE_EMBEDDING_MODEL_NAME)
-IMAGE_EMBEDDING_MODEL = ImageEmbedding(model_name=IMAGE_EMBEDDING_MODEL_NAME)
-SPARSE_EMBEDDING_MODEL = SparseTextEmbedding(model_name=SPARSE_EMBEDDING_MODEL_NAME)
+from qdrant_client.models import (
+    PointStruct, SparseVector, PointIdsList,
+    Filter, FieldCondition, MatchValue,
+)
+
+# allow running this file directly as `uv run src/qdrant_util/ingest_data.py`
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from qdrant_util.embedding_models import (
+    get_dense_embedding_model,
+    get_sparse_embedding_model,
+    get_image_embedding_model,
+    get_embedding_model_stats
+)
+from qdrant_util.retrieval_cache import bump_collection_generation
+from qdrant_util.ingest_state import IngestionManifest, Quarantine, compute_chunk_hash
+
 client = QdrantClient(host="localhost", port=6333)
 
-def process_unstructured_files(directory_path, tenant_id, points_list):
+# rows read from a CSV at a time, so large exports are never fully loaded (0 reads the whole file)
+CSV_CHUNK_SIZE = int(os.getenv("INGEST_CSV_CHUNK_SIZE", 10_000))
+
+# point ids are uuid5 of tenant + source + natural key, so re-ingesting a row overwrites its point
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_DNS, "lyzr-qdrant-customer-support")
+
+# Every source yields records shaped (natural_key, text_to_embed, image_to_embed or None, payload)
+
+# id fields of the knowledge base entries, tried in order
+KNOWLEDGE_BASE_ID_FIELDS = ("id", "faq_id", "kb_id", "policy_id")
+
+def iter_csv_chunks(csv_path, chunksize=None):
+    chunksize = CSV_CHUNK_SIZE if chunksize is None else chunksize
+    if not chunksize:
+        yield pd.read_csv(csv_path)
+        return
+    yield from pd.read_csv(csv_path, chunksize=chunksize)
+
+def build_crm_records(df, tenant_id):
+    texts = "Customer: " + df["name"].astype(str) + ", Email: " + df["email"].astype(str)
+    for row, text_to_embed in zip(df.to_dict("records"), texts.tolist()):
+        payload = {"tenant_id": tenant_id, "source_type": "crm", **row, "text_embeded": text_to_embed}
+        yield row["customer_id"], text_to_embed, None, payload
+
+def build_helpdesk_records(df, tenant_id):
+    texts = "Ticket: " + df["issue_summary"].astype(str) + ", Status: " + df["status"].astype(str)
+    for row, text_to_embed in zip(df.to_dict("records"), texts.tolist()):
+        payload = {"tenant_id": tenant_id, "source_type": "helpdesk", **row, "text_embeded": text_to_embed}
+        yield row["ticket_id"], text_to_embed, None, payload
+
+def build_order_records(df, tenant_id, data_path):
+    texts = "Product Name: " + df["product_name"].astype(str) + ", Product Category: " + df["product_category"].astype(str)
+    images = f"{data_path}/{tenant_id}/images/" + df["order_id"].astype(str) + ".jpg"
+    for row, text_to_embed, image_to_embed in zip(df.to_dict("records"), texts.tolist(), images.tolist()):
+        payload = {
+            "tenant_id": tenant_id,
+            "source_type": "orders",
+            **row,
+            "text_embeded": text_to_embed,
+            "image_embedded": image_to_embed
+        }
+        yield row["order_id"], text_to_embed, image_to_embed, payload
+
+def iter_crm_records(data_path, tenant_id):
+    for df in iter_csv_chunks(f"{data_path}/{tenant_id}/crm_records.csv"):
+        yield from build_crm_records(df, tenant_id)
+
+def iter_helpdesk_records(data_path, tenant_id):
+    for df in iter_csv_chunks(f"{data_path}/{tenant_id}/helpdesk_logs.csv"):
+        yield from build_helpdesk_records(df, tenant_id)
+
+def knowledge_base_key(filename, item):
+    """
+    Natural key of a knowledge base entry: its id field, else a hash of its question/title.
+    Unlike its position in the file, it doesn't change when other entries are added or removed.
+    """
+    for field in KNOWLEDGE_BASE_ID_FIELDS:
+        if item.get(field):
+            return f"{filename}:{item[field]}"
+    title = item.get("question", item.get("title", item.get("policy_type", "")))
+    return f"{filename}:{hashlib.sha256(str(title).encode('utf-8')).hexdigest()}"
+
+def process_unstructured_files(directory_path, tenant_id):
     """Dynamically reads all JSON files from a given directory."""
     for filename in os.listdir(directory_path):
         if filename.endswith(".json"):
             filepath = os.path.join(directory_path, filename)
             source_name = filename.split('.')[0]
-            
+
             with open(filepath, 'r') as f:
                 data = json.load(f)
 
-                for item in data:
-                    category = item.get(
-                        "question", item.get("title", {})
-                    )
-                    content = item.get(
-                        "answer", item.get(
-                            "content", item.get("description", "")
-                        )
-                    )
-                    tags = item.get("tags", {})
-                    
-                    if not content:
-                        continue
-
-                    text_to_embed = content
-                    # THIS CAN ONLY BE QUESTION/TITLE/POLICY_TYPE
-                    if source_name == 'faqs':
-                        text_to_embed = f"Question: {category}\nAnswer: {content}"
-                    elif source_name == 'handbook':
-                        text_to_embed = f"Title: {category}\nContent: {content}"
-                    elif source_name == 'policy':
-                        text_to_embed = f"Policy Type: {category}\nPolicy Description: {content}"
-
-                    payload = {
-                        "tenant_id": tenant_id,
-                        "source_type": source_name,
-                        "tags": tags,
-                        "content": text_to_embed,
-                    }
-                    points_list.append((text_to_embed, payload))
-
-def process_multimodal_files(data_path, tenant_id, points_list):
-    """Dynamically reads all JSON files from a given directory."""
-    order_path = f"{data_path}/{tenant_id}/orders.csv"
-    if os.path.exists(order_path):
-        order_df = pd.read_csv(order_path)
-
-        for _, row in order_df.iterrows():
-            text_to_embed = f"Product Name: {row['product_name']}, Product Category: {row['product_category']}"
-            image_to_embed = f"{data_path}/{tenant_id}/images/{row['order_id']}.jpg"
-            payload = {
-                "tenant_id": tenant_id, 
-                "source_type": "orders", 
-                **row.to_dict(), 
-                "text_embeded": text_to_embed, 
-                "image_embedded": image_to_embed
-            }
-            points_list.append((text_to_embed, image_to_embed, payload))
-
-def upsert_in_batch(text, payloads, collection_name, batch_size, image=None):
-    dense = list(DENSE_EMBEDDING_MODEL.embed(text))
-    sparse = list(SPARSE_EMBEDDING_MODEL.embed(text))
-    if image:
-        image_embeds = list(IMAGE_EMBEDDING_MODEL.embed(image))
-
-    total = len(text)
-    for i in tqdm(range(0, total, batch_size)):
-        batch_dense_embeddings = dense[i:i + batch_size]
-        batch_sparse_embeddings = sparse[i:i + batch_size]
-        batch_payloads = payloads[i:i + batch_size]
-
-        if image:
-            batch_image_embeddings = image_embeds[i:i + batch_size]
-            points = [
-                PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector={
-                        "dense": dense_embeddings,
-                        "sparse": SparseVector(indices=sparse_embeddings.indices, values=sparse_embeddings.values),
-                        "image": image_embeddings,
-                    },
-                    payload=payload
-                )
-                for dense_embeddings, sparse_embeddings, image_embeddings, payload in zip(
-                    batch_dense_embeddings, batch_sparse_embeddings, batch_image_embeddings, batch_payloads
+            for item in data:
+                category = item.get(
+                    "question", item.get("title", {})
                 )
-            ]
-        else:
-            points = [
-                PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector={
-                        "dense": dense_embeddings,
-                        "sparse": SparseVector(indices=sparse_embeddings.indices, values=sparse_embeddings.values)
-                    },
-                    payload=payload
+                content = item.get(
+                    "answer", item.get(
+                        "content", item.get("description", "")
+                    )
                 )
-                for dense_embeddings, sparse_embeddings, payload in zip(batch_dense_embeddings, batch_sparse_embeddings, batch_payloads)
-            ]
+                tags = item.get("tags", {})
+
+                if not content:
+                    continue
+
+                text_to_embed = content
+                # THIS CAN ONLY BE QUESTION/TITLE/POLICY_TYPE
+                if source_name == 'faqs':
+                    text_to_embed = f"Question: {category}\nAnswer: {content}"
+                elif source_name == 'handbook':
+                    text_to_embed = f"Title: {category}\nContent: {content}"
+                elif source_name == 'policy':
+                    text_to_embed = f"Policy Type: {category}\nPolicy Description: {content}"
+
+                payload = {
+                    "tenant_id": tenant_id,
+                    "source_type": source_name,
+                    "tags": tags,
+                    "content": text_to_embed,
+                }
+                yield knowledge_base_key(filename, item), text_to_embed, None, payload
+
+def process_multimodal_files(data_path, tenant_id):
+    """Reads the tenant's orders along with the path of each order's image."""
+    order_path = f"{data_path}/{tenant_id}/orders.csv"
+    if not os.path.exists(order_path):
+        return
 
-        client.upsert(
+    for df in iter_csv_chunks(order_path):
+        yield from build_order_records(df, tenant_id, data_path)
+
+def iter_knowledge_base_records(data_path, tenant_id):
+    return process_unstructured_files(f"{data_path}/{tenant_id}/knowledge_base", tenant_id)
+
+# source name -> (collection, record generator taking (data_path, tenant_id), source_type of its points or None for all)
+SOURCES = {
+    "crm": ("user_data", iter_crm_records, "crm"),
+    "helpdesk": ("user_data", iter_helpdesk_records, "helpdesk"),
+    "knowledge_base": ("knowledge_base", iter_knowledge_base_records, None),
+    "orders": ("orders", process_multimodal_files, None),
+}
+
+def make_point_id(tenant_id, source_type, natural_key):
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{tenant_id}:{source_type}:{natural_key}"))
+
+def compute_content_hash(text_to_embed, image_to_embed, payload):
+    """Hash of everything a point is built from, including the image bytes."""
+    content_hash = hashlib.sha256(json.dumps([text_to_embed, payload], sort_keys=True, default=str).encode("utf-8"))
+    if image_to_embed:
+        with open(image_to_embed, "rb") as f:
+            content_hash.update(f.read())
+    return content_hash.hexdigest()
+
+def prepare_records(records, quarantine=None, seen_ids=None):
+    """
+    Turns source records into (point_id, text_to_embed, image_to_embed, payload) with a `content_hash` payload field.
+    Rows that can't be hashed (e.g. a missing image) go to `quarantine` when given and stay in the stream
+    with a None `content_hash`, so the chunk boundaries of the rows after them don't move.
+    """
+    for natural_key, text_to_embed, image_to_embed, payload in records:
+        point_id = make_point_id(payload["tenant_id"], payload["source_type"], natural_key)
+        try:
+            payload = {**payload, "content_hash": compute_content_hash(text_to_embed, image_to_embed, payload)}
+        except Exception as e:
+            if quarantine is None:
+                raise
+            quarantine.add(point_id, text_to_embed, payload, e)
+            # keep the stored point of a row that is only temporarily broken
+            if seen_ids is not None:
+                seen_ids.add(point_id)
+            payload = {**payload, "content_hash": None}
+        yield point_id, text_to_embed, image_to_embed, payload
+
+def fetch_existing_hashes(collection_name, tenant_id, source_type=None, batch_size=1024):
+    """Returns {point_id: content_hash} of the points already stored for a (tenant, source) shard."""
+    must_clauses = [FieldCondition(key="tenant_id", match=MatchValue(value=tenant_id))]
+    if source_type:
+        must_clauses.append(FieldCondition(key="source_type", match=MatchValue(value=source_type)))
+
+    existing_hashes = {}
+    offset = None
+    while True:
+        points, offset = client.scroll(
             collection_name=collection_name,
-            points=points,
-            wait=True
+            scroll_filter=Filter(must=must_clauses),
+            limit=batch_size,
+            offset=offset,
+            with_payload=["content_hash"],
+            with_vectors=False,
+        )
+        for point in points:
+            existing_hashes[str(point.id)] = point.payload.get("content_hash")
+        if offset is None:
+            break
+    return existing_hashes
+
+def skip_unchanged(records, existing_hashes, stats):
+    """Only lets through records that are new or whose content hash changed; records every id seen."""
+    for record in records:
+        point_id, _, _, payload = record
+        stats["seen_ids"].add(point_id)
+        if payload["content_hash"] is not None and existing_hashes.get(point_id) == payload["content_hash"]:
+            stats["unchanged"] += 1
+            continue
+        yield record
+
+# the three embedding models run concurrently on each chunk (onnxruntime releases the GIL)
+_embedding_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="embedding")
+
+def iter_chunks(records, chunk_size):
+    records = iter(records)
+    while chunk := list(islice(records, chunk_size)):
+        yield chunk
+
+def _embed(get_model, inputs, embed_parallel=None):
+    return list(get_model().embed(inputs, batch_size=len(inputs), parallel=embed_parallel))
+
+def embed_chunk(chunk, embed_parallel=None):
+    """
+    Embeds one chunk of records with the dense, sparse and (for orders) image models concurrently
+    and returns its points. `embed_parallel` is passed to fastembed to spread a model over processes.
+    """
+    texts = [text for _, text, _, _ in chunk]
+    images = [image for _, _, image, _ in chunk]
+    dense = _embedding_pool.submit(_embed, get_dense_embedding_model, texts, embed_parallel)
+    sparse = _embedding_pool.submit(_embed, get_sparse_embedding_model, texts, embed_parallel)
+    image_embeds = _embedding_pool.submit(_embed, get_image_embedding_model, images, embed_parallel) if all(images) else None
+    dense, sparse = dense.result(), sparse.result()
+    image_embeds = image_embeds.result() if image_embeds is not None else [None] * len(chunk)
+
+    points = []
+    for (point_id, _, _, payload), dense_embeddings, sparse_embeddings, image_embeddings in zip(chunk, dense, sparse, image_embeds):
+        vector = {
+            "dense": dense_embeddings,
+            "sparse": SparseVector(indices=sparse_embeddings.indices, values=sparse_embeddings.values),
+        }
+        if image_embeddings is not None:
+            vector["image"] = image_embeddings
+        points.append(PointStruct(id=point_id, vector=vector, payload=payload))
+    return points
+
+def embed_chunk_with_quarantine(chunk, quarantine, embed_parallel=None):
+    """
+    Embeds a chunk, falling back to one row at a time when it fails so a single corrupt record
+    only quarantines itself. Rows already quarantined by `prepare_records` are left out.
+    Returns (points, number of quarantined rows).
+    """
+    records = [record for record in chunk if record[3]["content_hash"] is not None]
+    quarantined = len(chunk) - len(records)
+    if not records:
+        return [], quarantined
+    try:
+        return embed_chunk(records, embed_parallel), quarantined
+    except Exception:
+        if quarantine is None:
+            raise
+
+    points = []
+    for record in records:
+        try:
+            points.extend(embed_chunk([record], embed_parallel))
+        except Exception as e:
+            point_id, text_to_embed, _, payload = record
+            quarantine.add(point_id, text_to_embed, payload, e)
+            quarantined += 1
+    return points, quarantined
+
+def upload_points(collection_name, points, upload_parallel=1):
+    if not points:
+        return
+    if upload_parallel > 1:
+        client.upload_points(
+            collection_name=collection_name, points=points,
+            batch_size=max(1, len(points) // upload_parallel), parallel=upload_parallel, wait=True,
+        )
+    else:
+        client.upsert(collection_name=collection_name, points=points, wait=True)
+
+def upsert_in_batch(records, collection_name, batch_size, embed_parallel=None, upload_parallel=1, manifest=None, quarantine=None, resume=False):
+    """
+    Embeds and upserts `records` chunk by chunk. The upload of a chunk runs in the background
+    while the next chunk is embedded, so at most two chunks of points are held in memory.
+    With `upload_parallel` > 1 each chunk is sent by `upload_points` over that many processes.
+
+    Each fully uploaded chunk is committed to `manifest`; with `resume`, chunks already committed
+    with the same content are skipped. Chunks with quarantined rows aren't committed, so the next
+    resumed run retries them.
+    Returns (points upserted, points skipped as already committed).
+    """
+    total, resumed = 0, 0
+
+    def wait_for_upload(pending_upload):
+        future, chunk_index, chunk_hash, quarantined = pending_upload
+        future.result()
+        if manifest is not None and not quarantined:
+            manifest.commit(chunk_index, chunk_hash)
+
+    with ThreadPoolExecutor(max_workers=1) as uploader:
+        pending_upload = None
+        for chunk_index, chunk in enumerate(tqdm(iter_chunks(records, batch_size), desc=collection_name)):
+            chunk_hash = compute_chunk_hash(chunk) if manifest is not None else None
+            if resume and manifest.is_committed(chunk_index, chunk_hash):
+                resumed += len(chunk)
+                continue
+
+            points, quarantined = embed_chunk_with_quarantine(chunk, quarantine, embed_parallel)
+            if pending_upload is not None:
+                wait_for_upload(pending_upload)
+            future = uploader.submit(upload_points, collection_name, points, upload_parallel)
+            pending_upload = (future, chunk_index, chunk_hash, quarantined)
+            total += len(points)
+        if pending_upload is not None:
+            wait_for_upload(pending_upload)
+    return total, resumed
+
+def ingest_source(data_path, tenant_id, source, batch_size=64, embed_parallel=None, upload_parallel=1, incremental=False, resume=False, target_collections=None):
+    """
+    Ingests one (tenant, source) shard.
+    In incremental mode, rows whose content hash is unchanged are skipped and points whose row
+    no longer exists are deleted. With `resume`, a shard finished by the previous run is skipped,
+    as are the chunks an interrupted run committed.
+    Rows that fail are quarantined instead of aborting the shard.
+    `target_collections` maps a collection to the one actually written, e.g. a new blue/green version.
+    Returns (collection_name, stats, seconds) where collection_name is the one written.
+    """
+    collection_name, iter_records, source_type = SOURCES[source]
+    collection_name = (target_collections or {}).get(collection_name, collection_name)
+    start_time = time.perf_counter()
+    manifest = IngestionManifest(collection_name, tenant_id, source)
+    stats = {"upserted": 0, "unchanged": 0, "deleted": 0, "resumed": 0, "quarantined": 0, "seen_ids": set()}
+    if resume:
+        manifest.load()
+        if manifest.completed:
+            print(f"Skipping {source} for '{tenant_id}': finished by the previous run.")
+            del stats["seen_ids"]
+            return collection_name, stats, time.perf_counter() - start_time
+    else:
+        manifest.reset()
+    quarantine = Quarantine(collection_name, tenant_id, source)
+    records = prepare_records(iter_records(data_path, tenant_id), quarantine, stats["seen_ids"])
+
+    if incremental:
+        existing_hashes = fetch_existing_hashes(collection_name, tenant_id, source_type)
+        records = skip_unchanged(records, existing_hashes, stats)
+
+    stats["upserted"], stats["resumed"] = upsert_in_batch(
+        records, collection_name, batch_size, embed_parallel, upload_parallel, manifest, quarantine, resume
+    )
+    stats["quarantined"] = quarantine.count
+    # a shard with quarantined rows is picked up again by the next resumed run
+    if not quarantine.count:
+        manifest.mark_completed()
+
+    if incremental:
+        removed_ids = [point_id for point_id in existing_hashes if point_id not in stats["seen_ids"]]
+        if removed_ids:
+            client.delete(collection_name=collection_name, points_selector=PointIdsList(points=removed_ids), wait=True)
+        stats["deleted"] = len(removed_ids)
+
+    del stats["seen_ids"]
+    return collection_name, stats, time.perf_counter() - start_time
+
+def ingest_data(data_path, batch_size = 64, tenants = ("ecom", "fintech"), workers = 1, embed_parallel = None, upload_parallel = 1, incremental = False, resume = False, target_collections = None):
+    """
+    Streams all data sources into their respective collections.
+    With `workers` > 1 the (tenant, source) shards are ingested concurrently by a process pool,
+    each worker loading its own copy of the embedding models.
+    With `incremental`, only new or changed rows are embedded and removed rows are deleted.
+    With `resume`, each shard continues after the chunks committed by the previous run.
+    With `target_collections`, e.g. {"knowledge_base": "knowledge_base_v7"}, those collections are written instead.
+    Returns the per-collection totals.
+    """
+    shards = [(tenant, source) for tenant in tenants for source in SOURCES]
+    start_time = time.perf_counter()
+    collection_totals = {}
+
+    def report(tenant, source, collection_name, stats, seconds):
+        totals = collection_totals.setdefault(
+            collection_name, {"upserted": 0, "unchanged": 0, "deleted": 0, "resumed": 0, "quarantined": 0}
         )
+        for key in totals:
+            totals[key] += stats[key]
+        print(
+            f"Ingested {stats['upserted']} {source} points for '{tenant}' into '{collection_name}' "
+            f"({stats['upserted'] / max(seconds, 1e-9):.1f} points/sec), "
+            f"{stats['unchanged']} unchanged, {stats['deleted']} deleted, "
+            f"{stats['resumed']} already committed, {stats['quarantined']} quarantined."
+        )
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(ingest_source, data_path, tenant, source, batch_size, embed_parallel, upload_parallel, incremental, resume, target_collections): (tenant, source)
+                for tenant, source in shards
+            }
+            for future in as_completed(futures):
+                report(*futures[future], *future.result())
+    else:
+        for tenant, source in shards:
+            report(tenant, source, *ingest_source(data_path, tenant, source, batch_size, embed_parallel, upload_parallel, incremental, resume, target_collections))
+
+    # invalidate cached retrievals of the changed collections in running chat sessions,
+    # a new blue/green version is only served (and invalidated) once its alias is switched
+    versioned_collections = set((target_collections or {}).values())
+    for collection_name, totals in collection_totals.items():
+        if (totals["upserted"] or totals["deleted"]) and collection_name not in versioned_collections:
+            bump_collection_generation(collection_name)
 
-def ingest_data(data_path, batch_size = 64):
-    """Processes all data sources and uploads them to their respective collections."""
-    user_data_points = []
-    kb_points = []
-    order_points = []
-
-    tenants = ["ecom", "fintech"]
-    for tenant in tenants:
-        print(f"\n--- Processing data for tenant: {tenant} ---")
-        
-        crm_df = pd.read_csv(f"{data_path}/{tenant}/crm_records.csv")
-        for _, row in crm_df.iterrows():
-            text_to_embed = f"Customer: {row['name']}, Email: {row['email']}"
-            payload = {"tenant_id": tenant, "source_type": "crm", **row.to_dict(), "text_embeded": text_to_embed}
-            user_data_points.append((text_to_embed, payload))
-
-        helpdesk_df = pd.read_csv(f"{data_path}/{tenant}/helpdesk_logs.csv")
-        for _, row in helpdesk_df.iterrows():
-            text_to_embed = f"Ticket: {row['issue_summary']}, Status: {row['status']}"
-            payload = {"tenant_id": tenant, "source_type": "helpdesk", **row.to_dict(), "text_embeded": text_to_embed}
-            user_data_points.append((text_to_embed, payload))
-
-        kb_path = f"{data_path}/{tenant}/knowledge_base"
-        process_unstructured_files(kb_path, tenant, kb_points)
-        process_multimodal_files(data_path, tenant, order_points)
-
-    user_data_texts, user_data_payloads = zip(*user_data_points)
-    upsert_in_batch(user_data_texts, user_data_payloads, "user_data", batch_size)
-    print(f"\nIngested {len(user_data_points)} points into 'user_data' collection.")
-
-    kb_texts, kb_payloads = zip(*kb_points)
-    upsert_in_batch(kb_texts, kb_payloads, "knowledge_base", batch_size)
-    print(f"Ingested {len(kb_points)} points into 'knowledge_base' collection.")
-
-    order_texts, order_image, order_payload = zip(*order_points)
-    upsert_in_batch(order_texts, order_payload, "orders", batch_size, image=order_image)
-    print(f"Ingested {len(order_points)} points into 'orders' collection.")
+    seconds = time.perf_counter() - start_time
+    total = sum(totals["upserted"] for totals in collection_totals.values())
+    print(f"\nIngested {total} points in {seconds:.1f}s ({total / max(seconds, 1e-9):.1f} points/sec): {collection_totals}")
+    if workers <= 1:
+        print(f"Embedding model stats: {get_embedding_model_stats()}")
+    return collection_totals
+
+def _build_records_with_iterrows(df, tenant_id, text_columns, key_column, source_type):
+    """The previous row-by-row loader, kept as the baseline of `benchmark_source_loading`."""
+    for _, row in df.iterrows():
+        text_to_embed = ", ".join(f"{label}: {row[column]}" for label, column in text_columns)
+        payload = {"tenant_id": tenant_id, "source_type": source_type, **row.to_dict(), "text_embeded": text_to_embed}
+        yield row[key_column], text_to_embed, None, payload
+
+def benchmark_source_loading(data_path, tenant_id="ecom", rows=100_000):
+    """Micro-benchmark of building records from the CSV sources, iterrows vs vectorized, in rows/sec."""
+    benchmarks = {
+        "crm_records.csv": (
+            lambda df: build_crm_records(df, tenant_id),
+            [("Customer", "name"), ("Email", "email")], "customer_id", "crm",
+        ),
+        "helpdesk_logs.csv": (
+            lambda df: build_helpdesk_records(df, tenant_id),
+            [("Ticket", "issue_summary"), ("Status", "status")], "ticket_id", "helpdesk",
+        ),
+        "orders.csv": (
+            lambda df: build_order_records(df, tenant_id, data_path),
+            [("Product Name", "product_name"), ("Product Category", "product_category")], "order_id", "orders",
+        ),
+    }
+    for filename, (build_records, text_columns, key_column, source_type) in benchmarks.items():
+        csv_path = f"{data_path}/{tenant_id}/{filename}"
+        if not os.path.exists(csv_path):
+            continue
+        df = pd.read_csv(csv_path)
+        # repeat the sample rows so the timings aren't dominated by noise
+        df = pd.concat([df] * (rows // len(df) + 1), ignore_index=True).head(rows)
+
+        start_time = time.perf_counter()
+        for _ in _build_records_with_iterrows(df, tenant_id, text_columns, key_column, source_type):
+            pass
+        iterrows_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for _ in build_records(df):
+            pass
+        vectorized_seconds = time.perf_counter() - start_time
+
+        print(
+            f"{filename}: iterrows {rows / iterrows_seconds:,.0f} rows/sec, "
+            f"vectorized {rows / vectorized_seconds:,.0f} rows/sec "
+            f"({iterrows_seconds / vectorized_seconds:.1f}x)"
+        )
 
 if __name__ == "__main__":
-    ingest_data(data_path = 'data')
+    parser = argparse.ArgumentParser(description="Ingest the tenants' data into Qdrant.")
+    parser.add_argument("--data-path", default="data")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1, help="processes ingesting (tenant, source) shards concurrently")
+    parser.add_argument("--embed-parallel", type=int, default=None, help="fastembed `parallel` per embedding call (0 = all cores)")
+    parser.add_argument("--upload-parallel", type=int, default=1, help="processes used by `upload_points` per chunk")
+    parser.add_argument("--incremental", action="store_true", help="skip unchanged rows and delete removed ones")
+    parser.add_argument("--resume", action="store_true", help="continue each shard after the chunks committed by the last run")
+    parser.add_argument("--benchmark-loading", action="store_true", help="only benchmark building records from the CSVs")
+    args = parser.parse_args()
+
+    if args.benchmark_loading:
+        benchmark_source_loading(args.data_path)
+        sys.exit()
+
+    ingest_data(
+        data_path=args.data_path,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        embed_parallel=args.embed_parallel,
+        upload_parallel=args.upload_parallel,
+        incremental=args.incremental,
+        resume=args.resume,
+    )
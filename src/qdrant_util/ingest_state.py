@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import hashlib
+
+INGEST_STATE_DIR = os.getenv("INGEST_STATE_DIR", "data/ingest_state")
+
+
+def compute_chunk_hash(chunk):
+    """Hash of the point ids and content hashes of a chunk of prepared records."""
+    chunk_hash = hashlib.sha256()
+    for point_id, _, _, payload in chunk:
+        chunk_hash.update(f"{point_id}:{payload['content_hash']}\n".encode("utf-8"))
+    return chunk_hash.hexdigest()
+
+
+class IngestionManifest:
+    """
+    Progress of one (collection, tenant, source) shard, kept as an append-only JSONL log:
+    one line per uploaded chunk with its hash, and a last line once the shard finished without
+    quarantined rows. Appending keeps each commit O(1) however many chunks the run has.
+    A resumed run skips finished shards and the chunks whose hash matches the committed one.
+    """
+    def __init__(self, collection_name: str, tenant_id: str, source: str, state_dir: str = INGEST_STATE_DIR):
+        self.path = os.path.join(state_dir, f"{collection_name}__{tenant_id}__{source}.jsonl")
+        self.chunk_hashes = {}
+        self.completed = False
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        valid_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # the last line of a run killed mid-write
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                if "chunk_index" in record:
+                    self.chunk_hashes[record["chunk_index"]] = record["chunk_hash"]
+                self.completed = record.get("completed", self.completed)
+        # drop the partial line so the next commit starts on a line of its own
+        if valid_bytes < os.path.getsize(self.path):
+            os.truncate(self.path, valid_bytes)
+        return self
+
+    def reset(self):
+        self.chunk_hashes = {}
+        self.completed = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        open(self.path, "w").close()
+
+    def _append(self, record):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({**record, "updated_at": time.time()}) + "\n")
+
+    def is_committed(self, chunk_index: int, chunk_hash: str):
+        return self.chunk_hashes.get(chunk_index) == chunk_hash
+
+    def commit(self, chunk_index: int, chunk_hash: str):
+        self.chunk_hashes[chunk_index] = chunk_hash
+        self._append({"chunk_index": chunk_index, "chunk_hash": chunk_hash})
+
+    def mark_completed(self):
+        self.completed = True
+        self._append({"completed": True})
+
+
+class Quarantine:
+    """
+    Appends rows that failed to ingest, with their error, to a JSONL file instead of aborting the run.
+    Each shard has its own file, so shards ingested by different worker processes never share one.
+    """
+    def __init__(self, collection_name: str, tenant_id: str, source: str, state_dir: str = INGEST_STATE_DIR):
+        self.path = os.path.join(state_dir, "quarantine", f"{collection_name}__{tenant_id}__{source}.jsonl")
+        self.shard = {"collection_name": collection_name, "tenant_id": tenant_id, "source": source}
+        self.count = 0
+
+    def add(self, point_id, text_to_embed, payload, error: Exception):
+        record = {
+            **self.shard,
+            "point_id": point_id,
+            "text_to_embed": text_to_embed,
+            "payload": payload,
+            "error": f"{type(error).__name__}: {error}",
+            "quarantined_at": time.time(),
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+        self.count += 1
+        print(f"Quarantined {self.shard['source']} row {point_id} for '{self.shard['tenant_id']}': {record['error']}")
@@ -1,64 +1,62 @@
 import json
 from qdrant_client import QdrantClient, models
-from fastembed import TextEmbedding, ImageEmbedding
-from fastembed import SparseTextEmbedding
 from qdrant_client.models import (
     Filter, FieldCondition, MatchValue, MatchAny,
-    Prefetch, SparseVector, FusionQuery, Fusion,
+    Prefetch, FusionQuery, Fusion,
 )
+from qdrant_util.embedding_models import get_image_embedding_model
+from qdrant_util.query_embedding import QueryEmbeddings
+from qdrant_util.retrieval_cache import retrieval_cache
 
+def build_search_params(oversampling: float = None, rescore: bool = True, hnsw_ef: int = None, exact: bool = False):
+    """
+    Search params for the dense and image prefetches of quantized collections: quantized candidates are
+    oversampled by `oversampling` and rescored with the original vectors.
+    """
+    return models.SearchParams(
+        hnsw_ef=hnsw_ef,
+        exact=exact,
+        quantization=models.QuantizationSearchParams(ignore=False, rescore=rescore, oversampling=oversampling),
+    )
 
-dense_embedding_model = TextEmbedding(model_name="BAAI/bge-small-en-v1.5")
-sparse_embedding_model = SparseTextEmbedding(model_name="prithivida/Splade_PP_en_v1")
-image_embedding_model = ImageEmbedding(model_name="Qdrant/clip-ViT-B-32-vision")
-
-def retrieve_context(
-    client: QdrantClient,
+def build_prefetches(
     collection_name: str,
     query_text: str,
-    tenant_id: str,
     image_path: str = None,
-    source_type: str = None,
-    tags: list[str] = None,
-    customer_id: str = None,
     k_prefetch: int = 10,
-    top_k: int = 5,
-    fusion_method: Fusion = Fusion.RRF,
+    query_embeddings: QueryEmbeddings = None,
+    search_params: models.SearchParams = None,
 ):
     """
-    Retrieve the top-K most semantically similar points matching the given filters.
+    Builds the sparse, dense and (for orders) image prefetch queries.
+    `search_params` (see `build_search_params`) applies to the dense and image prefetches.
     """
-
-    dense_vector = None
-    sparse_vec = None
     prefetches = []
 
     if query_text:
-        dense_vector = list(dense_embedding_model.embed([query_text]))[0]
-        sparse_result = list(sparse_embedding_model.embed([query_text]))[0]
-        sparse_vec = SparseVector(
-            indices=sparse_result.indices,
-            values=sparse_result.values,
-        )
+        if query_embeddings is None:
+            query_embeddings = QueryEmbeddings(query_text)
 
         prefetches.append(
-            Prefetch(query=sparse_vec, using="sparse", limit=k_prefetch)
+            Prefetch(query=query_embeddings.sparse, using="sparse", limit=k_prefetch)
         )
         prefetches.append(
-            Prefetch(
-                query=dense_vector.tolist() if hasattr(dense_vector, "tolist") else dense_vector,
-                using="dense",
-                limit=k_prefetch,
-            )
+            Prefetch(query=query_embeddings.dense, using="dense", limit=k_prefetch, params=search_params)
         )
 
     if image_path and collection_name == "orders":
-        from fastembed import ImageEmbedding
-        image_vec = list(image_embedding_model.embed([image_path]))[0]
+        image_vec = list(get_image_embedding_model().embed([image_path]))[0]
         prefetches.append(
-            Prefetch(query=image_vec, using="image", limit=k_prefetch)
+            Prefetch(query=image_vec, using="image", limit=k_prefetch, params=search_params)
         )
+    return prefetches
 
+def build_payload_filter(
+    tenant_id: str,
+    source_type: str = None,
+    tags: list[str] = None,
+    customer_id: str = None,
+):
     must_clauses = []
     if tenant_id:
         must_clauses.append(FieldCondition(key="tenant_id", match=MatchValue(value=tenant_id)))
@@ -69,7 +67,76 @@ def retrieve_context(
     if tags:
         must_clauses.append(FieldCondition(key="tags", match=MatchAny(any=tags)))
 
-    payload_filter = Filter(must=must_clauses)
+    return Filter(must=must_clauses)
+
+def context_cache_key(
+    collection_name: str,
+    query_text: str,
+    tenant_id: str,
+    image_path: str = None,
+    source_type: str = None,
+    tags: list[str] = None,
+    customer_id: str = None,
+    k_prefetch: int = 10,
+    top_k: int = 5,
+    fusion_method: Fusion = Fusion.RRF,
+    search_params: models.SearchParams = None,
+):
+    """Cache key shared by `retrieve_context` and `retrieve_context_batch` for the same search."""
+    return retrieval_cache.make_key(
+        collection_name,
+        query_text,
+        tenant_id=tenant_id,
+        image_path=image_path,
+        source_type=source_type,
+        tags=tags,
+        customer_id=customer_id,
+        k_prefetch=k_prefetch,
+        top_k=top_k,
+        fusion_method=fusion_method,
+        search_params=search_params,
+    )
+
+def format_hits(points):
+    return [
+        {
+            "id": hit.id,
+            'similarity_with_query': hit.score,
+            "payload": hit.payload
+        }
+        for hit in points
+    ]
+
+def retrieve_context(
+    client: QdrantClient,
+    collection_name: str,
+    query_text: str,
+    tenant_id: str,
+    image_path: str = None,
+    source_type: str = None,
+    tags: list[str] = None,
+    customer_id: str = None,
+    k_prefetch: int = 10,
+    top_k: int = 5,
+    fusion_method: Fusion = Fusion.RRF,
+    query_embeddings: QueryEmbeddings = None,
+    search_params: models.SearchParams = None,
+):
+    """
+    Retrieve the top-K most semantically similar points matching the given filters.
+    Pass `query_embeddings` to reuse the dense/sparse vectors already computed for this query,
+    and `search_params` to tune oversampling/rescoring on quantized vectors.
+    Results are served from the retrieval cache until the collection is re-ingested.
+    """
+    cache_key = context_cache_key(
+        collection_name, query_text, tenant_id, image_path, source_type, tags, customer_id, k_prefetch, top_k, fusion_method, search_params
+    )
+    cached_hits = retrieval_cache.get(cache_key)
+    if cached_hits is not None:
+        return cached_hits
+
+    prefetches = build_prefetches(collection_name, query_text, image_path, k_prefetch, query_embeddings, search_params)
+    payload_filter = build_payload_filter(tenant_id, source_type, tags, customer_id)
 
     fusion_query = FusionQuery(fusion=fusion_method)
 
@@ -82,20 +149,84 @@ def retrieve_context(
         with_payload=True
     )
 
-    return [
-        {
-            "id": hit.id,
-            'similarity_with_query': hit.score,
-            "payload": hit.payload
-        }
-        for hit in results.points
-    ]
+    hits = format_hits(results.points)
+    retrieval_cache.put(cache_key, hits)
+    return hits
+
+def retrieve_context_batch(
+    client: QdrantClient,
+    query_text: str,
+    requests: list[dict],
+    k_prefetch: int = 10,
+    fusion_method: Fusion = Fusion.RRF,
+    query_embeddings: QueryEmbeddings = None,
+    search_params: models.SearchParams = None,
+):
+    """
+    Runs several hybrid searches for the same query in one `query_batch_points` call per collection.
+
+    Each request is a dict with `collection_name` and optionally `tenant_id`, `source_type`,
+    `customer_id`, `tags` and `top_k`. Returns the result sets in the same order as `requests`.
+    Requests already in the retrieval cache are not sent to Qdrant.
+    """
+    if query_embeddings is None:
+        query_embeddings = QueryEmbeddings(query_text)
+
+    results = [None] * len(requests)
+    cache_keys = [None] * len(requests)
+
+    # Qdrant batches queries per collection, so group the requests while remembering their position
+    grouped_requests = {}
+    for position, request in enumerate(requests):
+        cache_keys[position] = context_cache_key(
+            request["collection_name"],
+            query_text,
+            request.get("tenant_id"),
+            source_type=request.get("source_type"),
+            tags=request.get("tags"),
+            customer_id=request.get("customer_id"),
+            k_prefetch=k_prefetch,
+            top_k=request.get("top_k", 5),
+            fusion_method=fusion_method,
+            search_params=search_params,
+        )
+        results[position] = retrieval_cache.get(cache_keys[position])
+        if results[position] is not None:
+            continue
+
+        query_request = models.QueryRequest(
+            prefetch=build_prefetches(request["collection_name"], query_text, None, k_prefetch, query_embeddings, search_params),
+            query=FusionQuery(fusion=fusion_method),
+            filter=build_payload_filter(
+                request.get("tenant_id"),
+                request.get("source_type"),
+                request.get("tags"),
+                request.get("customer_id"),
+            ),
+            limit=request.get("top_k", 5),
+            with_payload=True,
+        )
+        grouped_requests.setdefault(request["collection_name"], []).append((position, query_request))
+
+    for collection_name, collection_requests in grouped_requests.items():
+        responses = client.query_batch_points(
+            collection_name=collection_name,
+            requests=[query_request for _, query_request in collection_requests],
+        )
+        for (position, _), response in zip(collection_requests, responses):
+            results[position] = format_hits(response.points)
+            retrieval_cache.put(cache_keys[position], results[position])
+    return results
 
 def retrieve_customer_info(
     client: QdrantClient,
     tenant_id: str,
     customer_id: str,
 ):
+    cache_key = retrieval_cache.make_key("user_data", tenant_id=tenant_id, source_type="crm", customer_id=customer_id)
+    return retrieval_cache.get_or_compute(cache_key, lambda: _scroll_customer_info(client, tenant_id, customer_id))
+
+def _scroll_customer_info(client: QdrantClient, tenant_id: str, customer_id: str):
     must_clauses = [
         FieldCondition(key="tenant_id", match=MatchValue(value=tenant_id))
     ]
@@ -119,7 +250,7 @@ def retrieve_customer_info(
     
     return results[0].payload
 
-def retrieve_customer_helpdesk_logs(client: QdrantClient, query: str, customer_id: str, tenant_id: str, top_k: int = 3, k_prefetch: int = 10) -> str:
+def retrieve_customer_helpdesk_logs(client: QdrantClient, query: str, customer_id: str, tenant_id: str, top_k: int = 3, k_prefetch: int = 10, query_embeddings: QueryEmbeddings = None) -> str:
     """
     Retrieves a comprehensive context for a user by fetching data from
     user_data (CRM, helpdesk) and knowledge_base collections.
@@ -135,18 +266,19 @@ def retrieve_customer_helpdesk_logs(client: QdrantClient, query: str, customer_i
         top_k=top_k,
         k_prefetch = k_prefetch,
         fusion_method = Fusion.RRF,
+        query_embeddings = query_embeddings,
     )
 
+    return format_helpdesk_logs(helpdesk_records, tenant_id, customer_id)
+
+def format_helpdesk_logs(helpdesk_records, tenant_id, customer_id):
     if not helpdesk_records:
         return f"No relevant customer helpdesk ticket found for this tenant_id: {tenant_id} and customer_id: {customer_id} for this particular query."
 
-    if helpdesk_records:
-        sanitized_records = [{k: v for k, v in record.items() if not k == 'id'} for record in helpdesk_records]
-        context = json.dumps(sanitized_records, indent=2)
-        
-    return context
+    sanitized_records = [{k: v for k, v in record.items() if not k == 'id'} for record in helpdesk_records]
+    return json.dumps(sanitized_records, indent=2)
 
-def retrieve_related_knowledge_base(client: QdrantClient, query: str, tenant_id: str, source_type: str, tags: list=None, top_k: int = 3, k_prefetch: int = 10) -> str:
+def retrieve_related_knowledge_base(client: QdrantClient, query: str, tenant_id: str, source_type: str, tags: list=None, top_k: int = 3, k_prefetch: int = 10, query_embeddings: QueryEmbeddings = None) -> str:
     related_kb = retrieve_context(
         client=client,
         collection_name="knowledge_base",
@@ -157,14 +289,62 @@ def retrieve_related_knowledge_base(client: QdrantClient, query: str, tenant_id:
         top_k=top_k,
         k_prefetch = k_prefetch,
         fusion_method = Fusion.RRF,
+        query_embeddings = query_embeddings,
     )
 
+    return format_knowledge_base(related_kb, tenant_id, source_type, tags)
+
+def format_knowledge_base(related_kb, tenant_id, source_type, tags=None):
     if not related_kb:
         return f"No relevant knowledge base found for tenant_id: {tenant_id}, source_type: {source_type} with tags: {tags} for this particular query"
-    
+
     sanitized_records = [{k: v for k, v in doc.items() if not k == 'id'} for doc in related_kb]
-    context = json.dumps(sanitized_records, indent=2)
-    return context
+    return json.dumps(sanitized_records, indent=2)
+
+def retrieve_turn_contexts(
+    client: QdrantClient,
+    query: str,
+    customer_id: str,
+    tenant_id: str,
+    kb_source_types: tuple = ("faqs", "policy", "handbook"),
+    top_k: int = 3,
+    k_prefetch: int = 10,
+    query_embeddings: QueryEmbeddings = None,
+) -> dict:
+    """
+    Retrieves the customer's helpdesk logs and every knowledge base source for a query in one batch.
+    Returns a dict keyed by "helpdesk" and each source type, formatted like the single retrievers.
+    """
+    requests = [
+        {
+            "collection_name": "user_data",
+            "tenant_id": tenant_id,
+            "source_type": "helpdesk",
+            "customer_id": customer_id,
+            "top_k": top_k,
+        }
+    ]
+    for source_type in kb_source_types:
+        requests.append({
+            "collection_name": "knowledge_base",
+            "tenant_id": tenant_id,
+            "source_type": source_type,
+            "top_k": top_k,
+        })
+
+    results = retrieve_context_batch(
+        client=client,
+        query_text=query,
+        requests=requests,
+        k_prefetch=k_prefetch,
+        fusion_method=Fusion.RRF,
+        query_embeddings=query_embeddings,
+    )
+
+    contexts = {"helpdesk": format_helpdesk_logs(results[0], tenant_id, customer_id)}
+    for source_type, related_kb in zip(kb_source_types, results[1:]):
+        contexts[source_type] = format_knowledge_base(related_kb, tenant_id, source_type)
+    return contexts
 
 def retrieve_order_info(
     client: QdrantClient,
@@ -172,6 +352,10 @@ def retrieve_order_info(
     customer_id: str,
     order_id: str,
 ):
+    cache_key = retrieval_cache.make_key("orders", tenant_id=tenant_id, customer_id=customer_id, order_id=order_id)
+    return retrieval_cache.get_or_compute(cache_key, lambda: _scroll_order_info(client, tenant_id, customer_id, order_id))
+
+def _scroll_order_info(client: QdrantClient, tenant_id: str, customer_id: str, order_id: str):
     must_clauses = [
         FieldCondition(key="tenant_id", match=MatchValue(value=tenant_id))
     ]
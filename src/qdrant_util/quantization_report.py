@@ -0,0 +1,174 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import pandas as pd
+from qdrant_client import QdrantClient, models
+
+# allow running this file directly as `uv run src/qdrant_util/quantization_report.py`
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from qdrant_util.embedding_models import get_dense_embedding_model, get_image_text_embedding_model
+from qdrant_util.qdrant_retriever import build_search_params
+from qdrant_util.setup_qdrant import build_quantization_config
+from qdrant_util.retrieval_benchmark import BENCHMARK_OPTIMIZERS_CONFIG, BENCHMARK_FULL_SCAN_THRESHOLD, wait_until_indexed
+
+client = QdrantClient(host="localhost", port=6333)
+
+# bytes per dimension of the vectors searched in RAM, used to estimate their footprint
+BYTES_PER_DIMENSION = {None: 4, "scalar": 1, "binary": 1 / 8}
+
+
+def load_faq_questions(data_path: str = "data"):
+    """The FAQ questions of every tenant, used as realistic queries against the knowledge base."""
+    questions = []
+    for faq_path in sorted(glob.glob(f"{data_path}/*/knowledge_base/faqs.json")):
+        with open(faq_path) as f:
+            questions.extend(item["question"] for item in json.load(f) if item.get("question"))
+    return questions
+
+
+def load_product_names(data_path: str = "data"):
+    """The distinct product names of every tenant's orders, used as text queries against the order images."""
+    product_names = set()
+    for order_path in sorted(glob.glob(f"{data_path}/*/orders.csv")):
+        product_names.update(pd.read_csv(order_path)["product_name"].dropna().astype(str))
+    return sorted(product_names)
+
+
+# named vector -> (query texts, model embedding them into that vector's space)
+QUERY_SOURCES = {
+    "dense": (load_faq_questions, get_dense_embedding_model),
+    "image": (load_product_names, get_image_text_embedding_model),
+}
+
+
+def copy_vectors(source_collection: str, target_collection: str, vector_name: str, size: int, distance, quantization: str = None, batch_size: int = 256):
+    """
+    Copies one named vector of `source_collection` into a new collection with the given quantization.
+    The copy is indexed from its first point, like the benchmark collections, since Qdrant only builds
+    the HNSW index and the quantized vectors once a segment is optimized.
+    """
+    if client.collection_exists(target_collection):
+        client.delete_collection(collection_name=target_collection)
+    client.create_collection(
+        collection_name=target_collection,
+        vectors_config={
+            vector_name: models.VectorParams(
+                size=size,
+                distance=distance,
+                on_disk=True,
+                quantization_config=build_quantization_config(quantization),
+            )
+        },
+        optimizers_config=BENCHMARK_OPTIMIZERS_CONFIG,
+        hnsw_config=models.HnswConfigDiff(full_scan_threshold=BENCHMARK_FULL_SCAN_THRESHOLD),
+    )
+
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source_collection,
+            limit=batch_size,
+            offset=offset,
+            with_payload=False,
+            with_vectors=[vector_name],
+        )
+        client.upsert(
+            collection_name=target_collection,
+            points=[models.PointStruct(id=point.id, vector={vector_name: point.vector[vector_name]}) for point in points],
+            wait=True,
+        )
+        if offset is None:
+            break
+
+    wait_until_indexed(target_collection)
+    indexed_vectors_count = client.get_collection(collection_name=target_collection).indexed_vectors_count
+    if not indexed_vectors_count:
+        raise RuntimeError(f"'{target_collection}' has no indexed vectors, its searches would not use the index or the quantized vectors.")
+
+
+def search_ids(collection_name: str, vector_name: str, query_vector, k: int, search_params=None):
+    results = client.query_points(
+        collection_name=collection_name,
+        query=query_vector,
+        using=vector_name,
+        limit=k,
+        search_params=search_params,
+    )
+    return [point.id for point in results.points]
+
+
+def quantization_report(
+    source_collection: str = "knowledge_base",
+    vector_name: str = "dense",
+    data_path: str = "data",
+    k: int = 5,
+    oversampling: float = 2.0,
+    methods=("scalar", "binary"),
+):
+    """
+    Compares quantized copies of one named vector against the float32 baseline: recall@k against
+    exact search, with and without rescoring, and mean latency. Queries are the FAQ questions for
+    "dense" and the product names, embedded with the CLIP text model, for "image".
+    `vector_ram_mb_estimate` is points x dimensions x bytes per dimension of the vectors searched in
+    memory (float32 for the baseline, the quantized codes otherwise), not a measurement.
+    """
+    load_queries, get_query_model = QUERY_SOURCES[vector_name]
+    questions = load_queries(data_path)
+    query_vectors = [vector.tolist() for vector in get_query_model().embed(questions)]
+
+    vector_params = client.get_collection(collection_name=source_collection).config.params.vectors[vector_name]
+    num_points = client.count(collection_name=source_collection, exact=True).count
+
+    baseline_collection = f"{source_collection}_quantization_baseline"
+    copy_vectors(source_collection, baseline_collection, vector_name, vector_params.size, vector_params.distance)
+    exact = build_search_params(exact=True)
+    ground_truth = [search_ids(baseline_collection, vector_name, query_vector, k, exact) for query_vector in query_vectors]
+
+    rows = []
+    for method in (None, *methods):
+        collection_name = baseline_collection if method is None else f"{source_collection}_quantization_{method}"
+        if method is not None:
+            copy_vectors(source_collection, collection_name, vector_name, vector_params.size, vector_params.distance, method)
+
+        settings = [("baseline", None)] if method is None else [
+            ("no rescore", build_search_params(rescore=False)),
+            (f"rescore, oversampling {oversampling}", build_search_params(oversampling=oversampling, rescore=True)),
+        ]
+        for label, search_params in settings:
+            hits, latencies = 0, []
+            for query_vector, expected_ids in zip(query_vectors, ground_truth):
+                start_time = time.perf_counter()
+                found_ids = search_ids(collection_name, vector_name, query_vector, k, search_params)
+                latencies.append(time.perf_counter() - start_time)
+                hits += len(set(found_ids) & set(expected_ids))
+            rows.append({
+                "quantization": method or "none",
+                "search": label,
+                f"recall@{k}": hits / (k * len(query_vectors)),
+                "mean_latency_ms": 1000 * sum(latencies) / len(latencies),
+                "vector_ram_mb_estimate": num_points * vector_params.size * BYTES_PER_DIMENSION[method] / 1024 ** 2,
+            })
+
+        if method is not None:
+            client.delete_collection(collection_name=collection_name)
+    client.delete_collection(collection_name=baseline_collection)
+
+    print(f"{source_collection}.{vector_name}: {num_points} points, {len(questions)} queries")
+    for row in rows:
+        print("\t", row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and recall@k of quantized vectors against the float32 baseline.")
+    parser.add_argument("--collection", default="knowledge_base")
+    parser.add_argument("--vector", choices=list(QUERY_SOURCES), default="dense")
+    parser.add_argument("--data-path", default="data")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--oversampling", type=float, default=2.0)
+    args = parser.parse_args()
+
+    quantization_report(args.collection, args.vector, args.data_path, args.k, args.oversampling)
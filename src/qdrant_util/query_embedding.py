@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+from qdrant_client.models import SparseVector
+from qdrant_util.embedding_models import (
+    get_dense_embedding_model,
+    get_sparse_embedding_model
+)
+
+
+class QueryEmbeddings:
+    """
+    Dense and sparse embeddings of one query, each computed at most once.
+    Pass the same instance to every retrieval and cache lookup of a turn.
+    """
+    def __init__(self, query_text: str):
+        self.query_text = query_text
+        self._dense = None
+        self._sparse = None
+        self._lock = threading.Lock()
+        self.stats = {"dense_hits": 0, "dense_misses": 0, "sparse_hits": 0, "sparse_misses": 0}
+
+    @property
+    def dense(self):
+        with self._lock:
+            if self._dense is None:
+                self.stats["dense_misses"] += 1
+                dense_vector = list(get_dense_embedding_model().embed([self.query_text]))[0]
+                self._dense = dense_vector.tolist() if hasattr(dense_vector, "tolist") else dense_vector
+            else:
+                self.stats["dense_hits"] += 1
+            return self._dense
+
+    @property
+    def sparse(self):
+        with self._lock:
+            if self._sparse is None:
+                self.stats["sparse_misses"] += 1
+                sparse_result = list(get_sparse_embedding_model().embed([self.query_text]))[0]
+                self._sparse = SparseVector(
+                    indices=sparse_result.indices.tolist(),
+                    values=sparse_result.values.tolist(),
+                )
+            else:
+                self.stats["sparse_hits"] += 1
+            return self._sparse
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU of QueryEmbeddings so repeated queries across turns are not re-embedded."""
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query_text: str) -> QueryEmbeddings:
+        with self._lock:
+            query_embeddings = self._entries.get(query_text)
+            if query_embeddings is not None:
+                self._entries.move_to_end(query_text)
+                self.hits += 1
+                return query_embeddings
+
+            self.misses += 1
+            query_embeddings = QueryEmbeddings(query_text)
+            if self.max_size > 0:
+                self._entries[query_text] = query_embeddings
+                if len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            return query_embeddings
+
+    def get_stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
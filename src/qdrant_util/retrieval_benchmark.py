@@ -0,0 +1,355 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import itertools
+import urllib.request
+import numpy as np
+import pandas as pd
+from qdrant_client import QdrantClient, models
+from qdrant_client.models import Fusion
+
+# allow running this file directly as `uv run src/qdrant_util/retrieval_benchmark.py`
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from qdrant_util.ingest_data import ingest_data, make_point_id, knowledge_base_key
+from qdrant_util.setup_qdrant import COLLECTION_CONFIGS, create_collection
+from qdrant_util.qdrant_retriever import retrieve_context, build_search_params
+from qdrant_util.query_embedding import QueryEmbeddings
+from qdrant_util.retrieval_cache import retrieval_cache
+
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+client = QdrantClient(host="localhost", port=6333)
+
+# small benchmark collections would otherwise stay unindexed and answer every query by full scan,
+# making all HNSW settings look identical (indexing_threshold=0 would disable indexing, hence 1 KB)
+BENCHMARK_OPTIMIZERS_CONFIG = models.OptimizersConfigDiff(indexing_threshold=1)
+BENCHMARK_FULL_SCAN_THRESHOLD = 10  # KB, the lowest Qdrant accepts
+
+# collections searched by the labeled queries, and the ones ingested alongside them
+BENCHMARK_COLLECTIONS = ("user_data", "knowledge_base")
+SOURCE_COLLECTIONS = {name: f"benchmark_source_{name}" for name in ("user_data", "knowledge_base", "orders")}
+
+
+def load_labeled_queries(data_path: str = "data", tenants=("ecom", "fintech"), queries_path: str = None, self_retrieval: bool = False):
+    """
+    Labeled queries shaped {collection_name, tenant_id, source_type, query_text, relevant_ids}.
+    Without `queries_path` they are the held-out paraphrases of FAQ questions in
+    `<data_path>/<tenant>/retrieval_queries.json`, or with `self_retrieval` (and as a fallback when
+    there are none) the self-retrieval queries of `derive_self_retrieval_queries`.
+    """
+    if queries_path:
+        with open(queries_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    queries = [] if self_retrieval else load_paraphrased_queries(data_path, tenants)
+    if not queries:
+        print("Using self-retrieval queries: recall and MRR saturate, so only treat the results as a smoke test.")
+        queries = derive_self_retrieval_queries(data_path, tenants)
+    return queries
+
+
+def load_paraphrased_queries(data_path: str = "data", tenants=("ecom", "fintech")):
+    """Hand-written paraphrases of FAQ questions, labeled with the faq_id they should retrieve."""
+    queries = []
+    for tenant_id in tenants:
+        queries_path = f"{data_path}/{tenant_id}/retrieval_queries.json"
+        if not os.path.exists(queries_path):
+            continue
+        with open(queries_path) as f:
+            for item in json.load(f):
+                queries.append({
+                    "collection_name": "knowledge_base",
+                    "tenant_id": tenant_id,
+                    "source_type": "faqs",
+                    "query_text": item["query_text"],
+                    "relevant_ids": [make_point_id(tenant_id, "faqs", knowledge_base_key("faqs.json", item))],
+                })
+    return queries
+
+
+def derive_self_retrieval_queries(data_path: str = "data", tenants=("ecom", "fintech")):
+    """
+    Queries derived from the corpus: each FAQ question should retrieve its FAQ and each helpdesk
+    issue summary its ticket. The query text is part of the embedded text, so this is only a smoke test.
+    """
+    queries = []
+    for tenant_id in tenants:
+        faq_path = f"{data_path}/{tenant_id}/knowledge_base/faqs.json"
+        if os.path.exists(faq_path):
+            with open(faq_path) as f:
+                for item in json.load(f):
+                    if item.get("question") and item.get("answer"):
+                        queries.append({
+                            "collection_name": "knowledge_base",
+                            "tenant_id": tenant_id,
+                            "source_type": "faqs",
+                            "query_text": item["question"],
+                            "relevant_ids": [make_point_id(tenant_id, "faqs", knowledge_base_key("faqs.json", item))],
+                        })
+
+        helpdesk_path = f"{data_path}/{tenant_id}/helpdesk_logs.csv"
+        if os.path.exists(helpdesk_path):
+            for row in pd.read_csv(helpdesk_path).to_dict("records"):
+                queries.append({
+                    "collection_name": "user_data",
+                    "tenant_id": tenant_id,
+                    "source_type": "helpdesk",
+                    "query_text": row["issue_summary"],
+                    "relevant_ids": [make_point_id(tenant_id, "helpdesk", row["ticket_id"])],
+                })
+    return queries
+
+
+def build_source_collections(data_path: str, tenants, reuse: bool = False):
+    """Ingests the corpus once into the benchmark source collections that every index config is copied from."""
+    if reuse and all(
+        client.collection_exists(name) and client.count(collection_name=name).count
+        for name in SOURCE_COLLECTIONS.values()
+    ):
+        return
+    for alias, name in SOURCE_COLLECTIONS.items():
+        if client.collection_exists(name):
+            client.delete_collection(collection_name=name)
+        create_collection(name, **COLLECTION_CONFIGS[alias])
+    ingest_data(data_path, tenants=tenants, target_collections=SOURCE_COLLECTIONS)
+
+
+def copy_collection(source_collection: str, target_collection: str, scale: int = 1, noise: float = 0.02, batch_size: int = 256, seed: int = 0):
+    """
+    Copies every point of `source_collection`. With `scale` > 1, each point gets `scale - 1` synthetic copies
+    whose dense vectors are perturbed by gaussian `noise`, acting as near-duplicate distractors.
+    """
+    rng = np.random.default_rng(seed)
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source_collection,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        copies = []
+        for point in points:
+            copies.append(models.PointStruct(id=point.id, vector=point.vector, payload=point.payload))
+            for copy_index in range(1, scale):
+                dense = np.asarray(point.vector["dense"]) + rng.normal(0, noise, len(point.vector["dense"]))
+                copies.append(models.PointStruct(
+                    id=str(uuid.uuid5(uuid.UUID(str(point.id)), str(copy_index))),
+                    vector={**point.vector, "dense": (dense / np.linalg.norm(dense)).tolist()},
+                    payload={**point.payload, "synthetic_copy": copy_index},
+                ))
+        if copies:
+            client.upsert(collection_name=target_collection, points=copies, wait=True)
+        if offset is None:
+            break
+
+
+def wait_until_indexed(collection_name: str, timeout: float = 600):
+    start_time = time.time()
+    while client.get_collection(collection_name=collection_name).status != models.CollectionStatus.GREEN:
+        if time.time() - start_time > timeout:
+            print(f"Collection '{collection_name}' still optimizing after {timeout}s, benchmarking anyway.")
+            return
+        time.sleep(1)
+
+
+def get_qdrant_memory_bytes():
+    """Resident memory of the Qdrant server from its /metrics endpoint, or None when unavailable."""
+    try:
+        with urllib.request.urlopen(f"{QDRANT_URL}/metrics", timeout=5) as response:
+            for line in response.read().decode().splitlines():
+                if line.startswith("memory_resident_bytes"):
+                    return float(line.split()[-1])
+    except OSError:
+        pass
+    return None
+
+
+def evaluate(collection_names: dict, queries: list, query_embeddings: list, k_prefetch: int, top_k: int, fusion_method: Fusion, hnsw_ef: int = None):
+    """Runs the labeled queries through `retrieve_context` and returns recall@top_k, MRR and latency percentiles."""
+    search_params = build_search_params(hnsw_ef=hnsw_ef) if hnsw_ef else None
+    recalls, reciprocal_ranks, latencies = [], [], []
+    for query, embeddings in zip(queries, query_embeddings):
+        start_time = time.perf_counter()
+        hits = retrieve_context(
+            client,
+            collection_names[query["collection_name"]],
+            query["query_text"],
+            query["tenant_id"],
+            source_type=query.get("source_type"),
+            k_prefetch=k_prefetch,
+            top_k=top_k,
+            fusion_method=fusion_method,
+            query_embeddings=embeddings,
+            search_params=search_params,
+        )
+        latencies.append(time.perf_counter() - start_time)
+
+        found_ids = [str(hit["id"]) for hit in hits]
+        relevant_ids = set(query["relevant_ids"])
+        recalls.append(len(relevant_ids & set(found_ids)) / len(relevant_ids))
+        ranks = [rank for rank, point_id in enumerate(found_ids, start=1) if point_id in relevant_ids]
+        reciprocal_ranks.append(1 / ranks[0] if ranks else 0.0)
+
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "recall@k": float(np.mean(recalls)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "latency_ms_p50": float(np.percentile(latencies_ms, 50)),
+        "latency_ms_p95": float(np.percentile(latencies_ms, 95)),
+        "latency_ms_p99": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def run_benchmark(
+    data_path: str = "data",
+    tenants=("ecom", "fintech"),
+    queries_path: str = None,
+    scale: int = 10,
+    m_values=(0, 16),
+    payload_m_values=(16,),
+    ef_construct_values=(100,),
+    on_disk_values=(True, False),
+    k_prefetch_values=(10, 20, 50),
+    top_k_values=(3, 5),
+    fusion_methods=(Fusion.RRF, Fusion.DBSF),
+    hnsw_ef_values=(None, 128),
+    reuse_source: bool = False,
+    keep_collections: bool = False,
+    self_retrieval: bool = False,
+):
+    """
+    Benchmarks retrieval quality and latency across a grid of index settings (HNSW m / payload_m /
+    ef_construct, on_disk) and query settings (k_prefetch, top_k, fusion, hnsw_ef).
+    Collections are rebuilt from the ingested source once per index config; query settings reuse them.
+    """
+    # every repetition must reach Qdrant
+    retrieval_cache.enabled = False
+
+    queries = load_labeled_queries(data_path, tenants, queries_path, self_retrieval)
+    # embed once up front (the properties cache their vectors) so latencies only measure the search
+    query_embeddings = [QueryEmbeddings(query["query_text"]) for query in queries]
+    for embeddings in query_embeddings:
+        _ = embeddings.dense, embeddings.sparse
+    print(f"Benchmarking {len(queries)} labeled queries, corpus scale x{scale}.")
+
+    build_source_collections(data_path, tenants, reuse=reuse_source)
+
+    results = []
+    for m, payload_m, ef_construct, on_disk in itertools.product(m_values, payload_m_values, ef_construct_values, on_disk_values):
+        index_config = {"m": m, "payload_m": payload_m, "ef_construct": ef_construct, "on_disk": on_disk}
+        memory_before = get_qdrant_memory_bytes()
+
+        collection_names = {}
+        for alias in BENCHMARK_COLLECTIONS:
+            name = f"benchmark_{alias}"
+            if client.collection_exists(name):
+                client.delete_collection(collection_name=name)
+            config = {key: value for key, value in COLLECTION_CONFIGS[alias].items() if key != "use_hnsw_optimization"}
+            create_collection(
+                name,
+                **config,
+                hnsw_config=models.HnswConfigDiff(
+                    m=m, payload_m=payload_m, ef_construct=ef_construct, on_disk=on_disk,
+                    full_scan_threshold=BENCHMARK_FULL_SCAN_THRESHOLD,
+                ),
+                on_disk=on_disk,
+                optimizers_config=BENCHMARK_OPTIMIZERS_CONFIG,
+            )
+            copy_collection(SOURCE_COLLECTIONS[alias], name, scale=scale)
+            wait_until_indexed(name)
+            collection_names[alias] = name
+
+        memory_after = get_qdrant_memory_bytes()
+        memory_mb = (memory_after - memory_before) / 1024 ** 2 if memory_before and memory_after else None
+        points = sum(client.count(collection_name=name, exact=True).count for name in collection_names.values())
+
+        for k_prefetch, top_k, fusion_method, hnsw_ef in itertools.product(k_prefetch_values, top_k_values, fusion_methods, hnsw_ef_values):
+            if k_prefetch < top_k:
+                continue
+            # one untimed pass warms up the caches of on-disk collections
+            evaluate(collection_names, queries[:20], query_embeddings[:20], k_prefetch, top_k, fusion_method, hnsw_ef)
+            metrics = evaluate(collection_names, queries, query_embeddings, k_prefetch, top_k, fusion_method, hnsw_ef)
+            row = {
+                **index_config,
+                "k_prefetch": k_prefetch,
+                "top_k": top_k,
+                "fusion": fusion_method.value,
+                "hnsw_ef": hnsw_ef,
+                "points": points,
+                "memory_delta_mb": memory_mb,
+                **metrics,
+            }
+            results.append(row)
+            print(row)
+
+        if not keep_collections:
+            for name in collection_names.values():
+                client.delete_collection(collection_name=name)
+
+    if not keep_collections:
+        for name in SOURCE_COLLECTIONS.values():
+            client.delete_collection(collection_name=name)
+    return results
+
+
+def print_summary(results):
+    """Best settings per top_k: highest recall, then MRR, then lowest p95 latency."""
+    for top_k in sorted({row["top_k"] for row in results}):
+        rows = [row for row in results if row["top_k"] == top_k]
+        best = max(rows, key=lambda row: (row["recall@k"], row["mrr"], -row["latency_ms_p95"]))
+        print(f"Best for top_k={top_k}: {best}")
+
+
+def _parse_list(value, cast=str):
+    return tuple(None if item == "none" else cast(item) for item in value.split(","))
+
+
+def _parse_bool(value):
+    return value.lower() == "true"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval quality/latency benchmark over index and query settings.")
+    parser.add_argument("--data-path", default="data")
+    parser.add_argument("--queries", default=None, help="JSONL of labeled queries, the paraphrased FAQ queries by default")
+    parser.add_argument("--self-retrieval", action="store_true", help="smoke test with queries copied from the corpus")
+    parser.add_argument("--scale", type=int, default=10, help="synthetic copies of the corpus (near-duplicate distractors)")
+    parser.add_argument("--m", default="0,16")
+    parser.add_argument("--payload-m", default="16")
+    parser.add_argument("--ef-construct", default="100")
+    parser.add_argument("--on-disk", default="true,false")
+    parser.add_argument("--k-prefetch", default="10,20,50")
+    parser.add_argument("--top-k", default="3,5")
+    parser.add_argument("--fusion", default="rrf,dbsf")
+    parser.add_argument("--hnsw-ef", default="none,128")
+    parser.add_argument("--reuse-source", action="store_true", help="reuse the ingested source collections of a previous run")
+    parser.add_argument("--keep-collections", action="store_true")
+    parser.add_argument("--output", default="data/benchmarks/retrieval_benchmark.json")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        data_path=args.data_path,
+        queries_path=args.queries,
+        scale=args.scale,
+        m_values=_parse_list(args.m, int),
+        payload_m_values=_parse_list(args.payload_m, int),
+        ef_construct_values=_parse_list(args.ef_construct, int),
+        on_disk_values=_parse_list(args.on_disk, _parse_bool),
+        k_prefetch_values=_parse_list(args.k_prefetch, int),
+        top_k_values=_parse_list(args.top_k, int),
+        fusion_methods=_parse_list(args.fusion, Fusion),
+        hnsw_ef_values=_parse_list(args.hnsw_ef, int),
+        reuse_source=args.reuse_source,
+        keep_collections=args.keep_collections,
+        self_retrieval=args.self_retrieval,
+    )
+    print_summary(results)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {len(results)} results to {args.output}")
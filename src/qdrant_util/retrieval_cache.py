@@ -0,0 +1,124 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from qdrant_util.caching import normalize_query
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", 2048))
+# state shared between processes is anchored here, so they agree whatever directory they were started from
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# shared with the ingestion process, which bumps a collection's generation after writing to it
+GENERATIONS_PATH = os.path.join(REPO_ROOT, os.getenv("RETRIEVAL_GENERATIONS_PATH", "data/retrieval_generations.json"))
+
+
+class CollectionGenerations:
+    """
+    Per-collection generation counters persisted to a small JSON file.
+    The file is only re-read when its mtime changes, so checking a generation costs one stat call.
+    """
+    def __init__(self, path: str = GENERATIONS_PATH):
+        self.path = path
+        self._generations = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with open(self.path) as f:
+                self._generations = json.load(f)
+            self._mtime = mtime
+
+    def get(self, collection_name: str):
+        with self._lock:
+            self._reload()
+            return self._generations.get(collection_name, 0)
+
+    def bump(self, collection_name: str):
+        """Invalidates every cached retrieval of `collection_name`, in this and other processes."""
+        with self._lock:
+            self._reload()
+            self._generations[collection_name] = self._generations.get(collection_name, 0) + 1
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._generations, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+            return self._generations[collection_name]
+
+
+class RetrievalCache:
+    """
+    Bounded LRU of retrieval results keyed on the collection, its generation, the normalized query
+    and the filter arguments. Entries of an older generation are never served and age out of the LRU.
+    """
+    def __init__(self, generations: CollectionGenerations, max_entries: int = 2048, enabled: bool = True):
+        self.generations = generations
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def make_key(self, collection_name: str, query_text: str = None, **arguments):
+        arguments = {
+            name: tuple(sorted(value)) if isinstance(value, (list, tuple, set)) else str(value) if value is not None else None
+            for name, value in arguments.items()
+        }
+        return (
+            collection_name,
+            self.generations.get(collection_name),
+            normalize_query(query_text) if query_text else None,
+            tuple(sorted(arguments.items())),
+        )
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key not in self._entries:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return self._entries[key]
+
+    def put(self, key, value):
+        if not self.enabled or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        return {"size": len(self._entries), **self.stats}
+
+
+collection_generations = CollectionGenerations()
+retrieval_cache = RetrievalCache(
+    collection_generations,
+    max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+    enabled=RETRIEVAL_CACHE_ENABLED,
+)
+
+
+def bump_collection_generation(collection_name: str):
+    return collection_generations.bump(collection_name)
@@ -1,29 +1,58 @@
+import os
+import re
+import sys
+import argparse
 from qdrant_client import QdrantClient, models
 
+# allow running this file directly as `uv run src/qdrant_util/setup_qdrant.py`
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from qdrant_util.retrieval_cache import bump_collection_generation
+from qdrant_util.qdrant_retriever import retrieve_context
+from qdrant_util.ingest_data import ingest_data
+
 DENSE_EMBEDDING_SIZE = 384
 IMAGE_EMBEDDING_SIZE = 512
 client = QdrantClient(host="localhost", port=6333)
 
-def create_or_recreate_collection(
-    name: str, 
-    indexes: dict, 
-    use_sparse: bool = True, 
+def build_quantization_config(method: str = None, always_ram: bool = True):
+    """
+    "scalar": int8 per dimension (4x smaller, small recall loss),
+    "binary": 1 bit per dimension (32x smaller, needs oversampling + rescoring), None: full float32.
+    With `always_ram` the quantized vectors stay in RAM while the originals stay on disk for rescoring.
+    """
+    if not method:
+        return None
+    if method == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=always_ram)
+        )
+    if method == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=always_ram))
+    raise ValueError(f"Unknown quantization method: {method}. Expected 'scalar', 'binary' or None.")
+
+def create_collection(
+    name: str,
+    indexes: dict,
+    use_sparse: bool = True,
     use_image: bool = False,
     use_hnsw_optimization: bool = False,
-    distance_metric: models.Distance = models.Distance.COSINE
+    distance_metric: models.Distance = models.Distance.COSINE,
+    quantization: dict = None,
+    hnsw_config: models.HnswConfigDiff = None,
+    on_disk: bool = True,
+    optimizers_config: models.OptimizersConfigDiff = None,
 ):
-    """Creates a new Qdrant collection with advanced options."""
-    try:
-        client.get_collection(collection_name=name)
-        print(f"Collection '{name}' already exists. Recreating it for a clean slate.")
-        client.delete_collection(collection_name=name)
-    except Exception:
-        pass
-
+    """
+    Creates a new Qdrant collection with advanced options.
+    `quantization` maps a named vector ("dense", "image") to its quantization method.
+    `hnsw_config` replaces the HNSW settings of `use_hnsw_optimization`, and `on_disk=False`
+    keeps the vectors, sparse index and payload in RAM (used by the retrieval benchmark).
+    `optimizers_config` overrides when segments get indexed, e.g. so small benchmark collections build HNSW.
+    """
     print(f"Creating collection '{name}'...")
-    
-    hnsw_config = None
-    if use_hnsw_optimization:
+    quantization = quantization or {}
+
+    if hnsw_config is None and use_hnsw_optimization:
         print(f"Applying HNSW optimization for collection '{name}'.")
         hnsw_config = models.HnswConfigDiff(
             payload_m=16,
@@ -36,7 +65,7 @@ def create_or_recreate_collection(
         sparse_vectors_config = {
             "sparse": models.SparseVectorParams(
                 index=models.SparseIndexParams(
-                    on_disk=True
+                    on_disk=on_disk
                 )
             )
         }
@@ -45,14 +74,16 @@ def create_or_recreate_collection(
         "dense": models.VectorParams(
             size=DENSE_EMBEDDING_SIZE,
             distance=distance_metric,
-            on_disk=True,
+            on_disk=on_disk,
+            quantization_config=build_quantization_config(quantization.get("dense")),
         ),
     }
     if use_image:
         vectors_config['image'] = models.VectorParams(
             size=IMAGE_EMBEDDING_SIZE,
             distance=distance_metric,
-            on_disk=True,   
+            on_disk=on_disk,
+            quantization_config=build_quantization_config(quantization.get("image")),
         )
 
     client.create_collection(
@@ -60,41 +91,296 @@ def create_or_recreate_collection(
         vectors_config=vectors_config,
         sparse_vectors_config=sparse_vectors_config,
         hnsw_config=hnsw_config,
-        on_disk_payload=True,
+        on_disk_payload=on_disk,
+        optimizers_config=optimizers_config,
     )
-    
+
     print(f"Creating payload indexes for '{name}'...")
     for field, field_type in indexes.items():
         client.create_payload_index(name, field, field_schema=field_type)
     print(f"Collection '{name}' created successfully.")
 
+def create_or_recreate_collection(name: str, indexes: dict, **collection_options):
+    """Drops `name` if it exists and creates it again. The collection is offline until re-ingested."""
+    if get_alias_target(name) is not None:
+        # recreating would either fail on the alias or leave it pointing at the old version
+        raise ValueError(f"'{name}' is an alias of a versioned collection; rebuild it with --blue-green.")
+    try:
+        client.get_collection(collection_name=name)
+        print(f"Collection '{name}' already exists. Recreating it for a clean slate.")
+        client.delete_collection(collection_name=name)
+    except Exception:
+        pass
+
+    create_collection(name, indexes, **collection_options)
 
-if __name__ == "__main__":
-    user_data_indexes = {
-        "tenant_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
-        "customer_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True)
-    }
 
-    kb_indexes = {
-        "tenant_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
-        "tags": models.KeywordIndexParams(type='keyword', on_disk=True),
-        "source_type": models.KeywordIndexParams(type='keyword', on_disk=True)
-    }
+user_data_indexes = {
+    "tenant_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
+    "customer_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True)
+}
 
-    create_or_recreate_collection("user_data", indexes=user_data_indexes, use_hnsw_optimization=True)
-    create_or_recreate_collection("knowledge_base", indexes=kb_indexes, use_hnsw_optimization=True)
+kb_indexes = {
+    "tenant_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
+    "tags": models.KeywordIndexParams(type='keyword', on_disk=True),
+    "source_type": models.KeywordIndexParams(type='keyword', on_disk=True)
+}
 
+cache_indexes = {
+    "tenant_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
+    "customer_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
+    # used by the TTL filter and the eviction sweeper
+    "created_at": models.PayloadSchemaType.FLOAT
+}
 
-    cache_indexes = {
-        "tenant_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
-        "customer_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True)
-    }
-    create_or_recreate_collection("semantic_cache", indexes=cache_indexes, use_sparse=False, distance_metric=models.Distance.EUCLID)
+order_indexes = {
+    "tenant_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
+    "customer_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
+    "order_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True)
+}
 
-    order_indexes = {
-        "tenant_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
-        "customer_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True),
-        "order_id": models.KeywordIndexParams(type='keyword', is_tenant=True, on_disk=True)
-    }
-    create_or_recreate_collection("orders", indexes=order_indexes, use_image=True)
-    print("Qdrant setup complete.")
\ No newline at end of file
+# collection (or alias) name -> options of create_collection.
+# knowledge_base and orders keep int8 copies of their dense/image vectors in RAM, so HNSW traversal
+# doesn't read the on-disk float32 vectors; see quantization_report.py for the recall impact.
+COLLECTION_CONFIGS = {
+    "user_data": {"indexes": user_data_indexes, "use_hnsw_optimization": True},
+    "knowledge_base": {"indexes": kb_indexes, "use_hnsw_optimization": True, "quantization": {"dense": "scalar"}},
+    "semantic_cache": {"indexes": cache_indexes, "use_sparse": False, "distance_metric": models.Distance.EUCLID},
+    "orders": {"indexes": order_indexes, "use_image": True, "quantization": {"dense": "scalar", "image": "scalar"}},
+}
+
+# queries that must return results from a freshly built version before its alias is switched
+VALIDATION_QUERIES = {
+    "user_data": [
+        {"query_text": "Unable to login to account", "tenant_id": "ecom", "source_type": "helpdesk"},
+        {"query_text": "Failed UPI transaction but amount debited", "tenant_id": "fintech", "source_type": "helpdesk"},
+    ],
+    "knowledge_base": [
+        {"query_text": "How do I track my order?", "tenant_id": "ecom", "source_type": "faqs"},
+        {"query_text": "How do I block my card?", "tenant_id": "fintech", "source_type": "faqs"},
+    ],
+    "orders": [
+        {"query_text": "Noise Cancelling Headphones", "tenant_id": "ecom"},
+    ],
+}
+
+
+# --- Blue/green reindexing ---
+# Every logical collection is an alias pointing to a versioned collection `<alias>_v<N>`.
+# A reindex builds the next version next to the live one, validates it and switches the alias
+# in a single atomic operation, so readers never see a missing or half-built collection.
+
+def get_alias_target(alias: str):
+    """Returns the collection `alias` points to, or None."""
+    for collection_alias in client.get_aliases().aliases:
+        if collection_alias.alias_name == alias:
+            return collection_alias.collection_name
+    return None
+
+def list_collection_versions(alias: str):
+    """Returns the versions of `alias` as sorted (version, collection_name) pairs."""
+    pattern = re.compile(rf"^{re.escape(alias)}_v(\d+)$")
+    versions = []
+    for collection in client.get_collections().collections:
+        match = pattern.match(collection.name)
+        if match:
+            versions.append((int(match.group(1)), collection.name))
+    return sorted(versions)
+
+def create_next_version(alias: str):
+    """Creates `<alias>_v<N+1>` with the alias's collection config and returns its name."""
+    versions = list_collection_versions(alias)
+    next_version = versions[-1][0] + 1 if versions else 1
+    name = f"{alias}_v{next_version}"
+    try:
+        create_collection(name, **COLLECTION_CONFIGS[alias])
+    except Exception:
+        # e.g. a payload index failed after the collection was created
+        if client.collection_exists(name):
+            client.delete_collection(collection_name=name)
+        raise
+    return name
+
+def validate_collection(alias: str, collection_name: str, min_ratio: float = 0.9):
+    """
+    Checks a new version before it goes live: it isn't empty, holds at least `min_ratio` of the
+    points of the live version, and every validation query returns results. Raises ValueError otherwise.
+    """
+    count = client.count(collection_name=collection_name, exact=True).count
+    if count == 0:
+        raise ValueError(f"Collection '{collection_name}' is empty.")
+
+    live_collection = get_alias_target(alias)
+    if live_collection:
+        live_count = client.count(collection_name=live_collection, exact=True).count
+        if count < min_ratio * live_count:
+            raise ValueError(
+                f"Collection '{collection_name}' has {count} points, less than {min_ratio:.0%} of the {live_count} in '{live_collection}'."
+            )
+
+    for query in VALIDATION_QUERIES.get(alias, []):
+        if not retrieve_context(client, collection_name, **query):
+            raise ValueError(f"Validation query {query} returned no results from '{collection_name}'.")
+    print(f"Collection '{collection_name}' validated with {count} points.")
+
+def get_plain_collections(aliases):
+    """The names of `aliases` that are still plain collections, i.e. not migrated by `migrate_to_aliases`."""
+    return [alias for alias in aliases if get_alias_target(alias) is None and client.collection_exists(alias)]
+
+def copy_collection_points(source_collection: str, target_collection: str, batch_size: int = 256):
+    """Copies every point of `source_collection`, with its vectors and payload, and returns how many were copied."""
+    copied = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source_collection,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            client.upsert(
+                collection_name=target_collection,
+                points=[models.PointStruct(id=point.id, vector=point.vector, payload=point.payload) for point in points],
+                wait=True,
+            )
+            copied += len(points)
+        if offset is None:
+            return copied
+
+def migrate_to_aliases(aliases=("user_data", "knowledge_base", "orders", "semantic_cache"), confirm: bool = False):
+    """
+    One-time step before the first blue/green reindex: copies each plain collection of `aliases` into
+    `<alias>_v<N>`, then replaces the plain collection with an alias to that copy.
+    A plain collection is only deleted once its copy holds every point, so its data is never lost; the
+    alias is created right after, so the collection is missing only for the time of that call.
+    Without `confirm` nothing is changed and the plan is printed.
+    """
+    plain_collections = get_plain_collections(aliases)
+    if not confirm:
+        for alias in plain_collections:
+            print(f"Would copy the plain collection '{alias}' into a new version and replace it with an alias.")
+        if plain_collections:
+            print("Re-run with --yes to migrate. Writes made to these collections during the migration are lost.")
+        return {}
+
+    copies = {}
+    try:
+        for alias in plain_collections:
+            copies[alias] = name = create_next_version(alias)
+            copied = copy_collection_points(alias, name)
+            expected = client.count(collection_name=alias, exact=True).count
+            if copied != expected:
+                raise ValueError(f"Copied {copied} of the {expected} points of '{alias}' into '{name}'.")
+            print(f"Copied the plain collection '{alias}' into '{name}' ({copied} points).")
+    except Exception:
+        # nothing was deleted yet, the plain collections keep serving
+        for name in copies.values():
+            if client.collection_exists(name):
+                client.delete_collection(collection_name=name)
+        raise
+
+    for alias, name in copies.items():
+        print(f"Replacing the plain collection '{alias}' with an alias to '{name}', which holds its data.")
+        client.delete_collection(collection_name=alias)
+        try:
+            client.update_collection_aliases(change_aliases_operations=[
+                models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=name, alias_name=alias))
+            ])
+        except Exception:
+            print(f"Creating the alias '{alias}' failed; its data is safe in '{name}'. Re-run the migration to retry.")
+            raise
+        bump_collection_generation(alias)
+    return copies
+
+def switch_aliases(targets: dict):
+    """Atomically points every alias of `targets` ({alias: collection_name}) to its collection in one update."""
+    plain_collections = get_plain_collections(targets)
+    if plain_collections:
+        raise ValueError(f"{', '.join(plain_collections)} are still plain collections; run --migrate-to-aliases first.")
+    operations = []
+    for alias, collection_name in targets.items():
+        if get_alias_target(alias) is not None:
+            operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+        operations.append(
+            models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=collection_name, alias_name=alias))
+        )
+    client.update_collection_aliases(change_aliases_operations=operations)
+    for alias, collection_name in targets.items():
+        # cached retrievals were read from the previous version
+        bump_collection_generation(alias)
+        print(f"Alias '{alias}' now points to '{collection_name}'.")
+
+def garbage_collect_versions(alias: str, keep: int = 1):
+    """Deletes old versions of `alias`, keeping the live one and the `keep` most recent others for rollback."""
+    live_collection = get_alias_target(alias)
+    old_versions = [name for _, name in list_collection_versions(alias) if name != live_collection]
+    stale_versions = old_versions[:-keep] if keep else old_versions
+    for name in stale_versions:
+        client.delete_collection(collection_name=name)
+        print(f"Deleted old collection '{name}'.")
+    return stale_versions
+
+def reindex_blue_green(data_path: str = "data", aliases=("user_data", "knowledge_base", "orders", "semantic_cache"), keep: int = 1, **ingest_options):
+    """
+    Rebuilds `aliases` under live traffic: creates the next version of each, ingests into them,
+    validates them and switches the aliases. The semantic cache is rebuilt empty.
+    Plain collections must have been migrated to aliases first, see `migrate_to_aliases`.
+    """
+    plain_collections = get_plain_collections(aliases)
+    if plain_collections:
+        raise ValueError(f"{', '.join(plain_collections)} are still plain collections; run --migrate-to-aliases first.")
+    new_collections = {}
+    try:
+        for alias in aliases:
+            new_collections[alias] = create_next_version(alias)
+        ingested = {alias: name for alias, name in new_collections.items() if alias != "semantic_cache"}
+        if ingested:
+            ingest_data(data_path, target_collections=ingested, **ingest_options)
+        for alias, name in ingested.items():
+            validate_collection(alias, name)
+    except Exception:
+        # keep serving the live versions and drop the half-built or rejected ones,
+        # so they are never kept as rollback targets
+        for name in new_collections.values():
+            if client.collection_exists(name):
+                client.delete_collection(collection_name=name)
+        raise
+
+    # every alias moves in the same update, so readers never mix old and new versions
+    switch_aliases(new_collections)
+    for alias in new_collections:
+        garbage_collect_versions(alias, keep=keep)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the Qdrant collections.")
+    parser.add_argument("--blue-green", action="store_true", help="build, ingest and validate new versions, then switch the aliases")
+    parser.add_argument("--migrate-to-aliases", action="store_true", help="one-time: copy the plain collections into versions served through aliases")
+    parser.add_argument("--yes", action="store_true", help="confirm --migrate-to-aliases, which deletes each plain collection once copied")
+    parser.add_argument("--data-path", default="data")
+    parser.add_argument("--keep", type=int, default=1, help="old versions kept for rollback")
+    parser.add_argument(
+        "--quantization", choices=["scalar", "binary", "none"], default=None,
+        help="override the quantization of every quantized dense/image vector",
+    )
+    args = parser.parse_args()
+
+    if args.quantization:
+        method = None if args.quantization == "none" else args.quantization
+        for config in COLLECTION_CONFIGS.values():
+            if "quantization" in config:
+                config["quantization"] = {vector_name: method for vector_name in config["quantization"]}
+
+    if args.migrate_to_aliases:
+        migrate_to_aliases(confirm=args.yes)
+    elif args.blue_green:
+        reindex_blue_green(args.data_path, keep=args.keep)
+    else:
+        aliased = [name for name in COLLECTION_CONFIGS if get_alias_target(name) is not None]
+        if aliased:
+            parser.error(f"{', '.join(aliased)} are served through aliases since a blue/green reindex; use --blue-green.")
+        for name, config in COLLECTION_CONFIGS.items():
+            create_or_recreate_collection(name, **config)
+    print("Qdrant setup complete.")
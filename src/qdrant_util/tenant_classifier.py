@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from qdrant_client import QdrantClient
+
+# allow running this file directly as `uv run src/qdrant_util/tenant_classifier.py`
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from qdrant_util.query_embedding import QueryEmbeddings
+from qdrant_util.retrieval_cache import REPO_ROOT, collection_generations
+
+# thresholds written by `calibrate`, read by every classifier whose threshold isn't given explicitly
+CALIBRATION_PATH = os.path.join(REPO_ROOT, os.getenv("TENANT_CLASSIFIER_CALIBRATION", "data/classifiers/tenant_classifier.json"))
+# used until the method is calibrated
+DEFAULT_THRESHOLDS = {"centroid": 0.03, "knn": 0.8}
+
+
+def load_tenant_queries(data_path: str = os.path.join(REPO_ROOT, "data"), tenants=("ecom", "fintech")):
+    """
+    Held-out (query_text, tenant_id) pairs: the paraphrased FAQ queries and the helpdesk issue summaries,
+    neither of which is stored in `knowledge_base`.
+    """
+    queries = []
+    for tenant_id in tenants:
+        paraphrases_path = f"{data_path}/{tenant_id}/retrieval_queries.json"
+        if os.path.exists(paraphrases_path):
+            with open(paraphrases_path) as f:
+                queries.extend((item["query_text"], tenant_id) for item in json.load(f))
+        helpdesk_path = f"{data_path}/{tenant_id}/helpdesk_logs.csv"
+        if os.path.exists(helpdesk_path):
+            queries.extend((text, tenant_id) for text in pd.read_csv(helpdesk_path)["issue_summary"].dropna().astype(str))
+    return queries
+
+
+def load_calibrated_threshold(method: str, path: str = CALIBRATION_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get(method, {}).get("threshold")
+
+
+class TenantClassifier:
+    """
+    Classifies a query into a tenant using the dense vectors already stored in `knowledge_base`.
+
+    - "centroid": cosine similarity to the mean vector of each tenant's documents,
+      confidence is the margin between the best and second best tenant.
+    - "knn": score-weighted vote of the `k` nearest documents,
+      confidence is the share of the vote won by the best tenant.
+
+    Without an explicit `threshold`, the one written by `calibrate` is used, else DEFAULT_THRESHOLDS.
+    Centroids are refitted whenever the collection's generation is bumped (re-ingest or alias switch).
+    """
+    def __init__(
+        self,
+        client: QdrantClient,
+        collection_name: str = "knowledge_base",
+        method: str = "centroid",
+        threshold: float = None,
+        k: int = 10,
+    ):
+        if method not in ("centroid", "knn"):
+            raise ValueError(f"Unknown tenant classification method: {method}. Expected 'centroid' or 'knn'.")
+        self.client = client
+        self.collection_name = collection_name
+        self.method = method
+        self.threshold_source = "explicit"
+        if threshold is None:
+            threshold = load_calibrated_threshold(method)
+            self.threshold_source = "calibrated"
+        if threshold is None:
+            threshold = DEFAULT_THRESHOLDS[method]
+            self.threshold_source = "default"
+            print(f"Tenant classifier '{method}' isn't calibrated, using the default threshold {threshold}.")
+        self.threshold = threshold
+        self.k = k
+        self.centroids = None
+        self._fitted_generation = None
+        self._lock = threading.Lock()
+
+    def fit(self, batch_size: int = 256):
+        """Builds one normalized centroid per tenant from the stored dense vectors."""
+        generation = collection_generations.get(self.collection_name)
+        sums, counts = {}, {}
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=["tenant_id"],
+                with_vectors=["dense"],
+            )
+            for point in points:
+                tenant_id = point.payload.get("tenant_id")
+                vector = np.asarray(point.vector["dense"], dtype=np.float32)
+                sums[tenant_id] = sums.get(tenant_id, 0) + vector / np.linalg.norm(vector)
+                counts[tenant_id] = counts.get(tenant_id, 0) + 1
+            if offset is None:
+                break
+
+        self.centroids = {
+            tenant_id: centroid / np.linalg.norm(centroid) for tenant_id, centroid in sums.items()
+        }
+        self._fitted_generation = generation
+        print(f"Fitted tenant centroids for {counts}")
+        return self
+
+    def _is_stale(self):
+        return self.centroids is None or self._fitted_generation != collection_generations.get(self.collection_name)
+
+    def _ensure_fitted(self):
+        if self._is_stale():
+            with self._lock:
+                if self._is_stale():
+                    self.fit()
+
+    def _classify_centroid(self, query_vector):
+        self._ensure_fitted()
+        if len(self.centroids) < 2:
+            return None, 0.0
+        query_vector = query_vector / np.linalg.norm(query_vector)
+        scores = sorted(
+            ((float(np.dot(query_vector, centroid)), tenant_id) for tenant_id, centroid in self.centroids.items()),
+            reverse=True,
+        )
+        return scores[0][1], scores[0][0] - scores[1][0]
+
+    def _classify_knn(self, query_vector):
+        results = self.client.query_points(
+            collection_name=self.collection_name,
+            query=query_vector.tolist(),
+            using="dense",
+            limit=self.k,
+            with_payload=["tenant_id"],
+        )
+        votes = {}
+        for hit in results.points:
+            tenant_id = hit.payload.get("tenant_id")
+            votes[tenant_id] = votes.get(tenant_id, 0) + max(hit.score, 0)
+        total = sum(votes.values())
+        if not total:
+            return None, 0.0
+        tenant_id = max(votes, key=votes.get)
+        return tenant_id, votes[tenant_id] / total
+
+    def predict(self, query_embeddings: QueryEmbeddings):
+        """Returns (tenant_id, confidence) of the best tenant, whatever the threshold."""
+        query_vector = np.asarray(query_embeddings.dense, dtype=np.float32)
+        if self.method == "centroid":
+            return self._classify_centroid(query_vector)
+        return self._classify_knn(query_vector)
+
+    def classify(self, query_embeddings: QueryEmbeddings):
+        """Returns (tenant_id, confidence), tenant_id is None when the confidence is below the threshold."""
+        tenant_id, confidence = self.predict(query_embeddings)
+        if confidence < self.threshold:
+            return None, confidence
+        return tenant_id, confidence
+
+    def evaluate(self, queries, threshold: float = None):
+        """Accuracy of the confident predictions and coverage (share not sent to the LLM) on (query_text, tenant_id) pairs."""
+        threshold = self.threshold if threshold is None else threshold
+        predictions = [self.predict(QueryEmbeddings(text)) + (tenant_id,) for text, tenant_id in queries]
+        confident = [(predicted, expected) for predicted, confidence, expected in predictions if confidence >= threshold]
+        return {
+            "method": self.method,
+            "threshold": threshold,
+            "queries": len(queries),
+            "coverage": len(confident) / len(queries) if queries else 0.0,
+            "accuracy": sum(predicted == expected for predicted, expected in confident) / len(confident) if confident else None,
+        }
+
+    def calibrate(self, queries, target_accuracy: float = 0.98, path: str = CALIBRATION_PATH):
+        """
+        Picks the lowest threshold whose confident predictions on the held-out `queries` are at least
+        `target_accuracy` correct, so the most queries skip the LLM, then saves it to `path`.
+        """
+        predictions = sorted(
+            (self.predict(QueryEmbeddings(text)) + (tenant_id,) for text, tenant_id in queries),
+            key=lambda prediction: prediction[1],
+            reverse=True,
+        )
+        # above every confidence: everything goes to the LLM when no threshold is accurate enough
+        threshold = predictions[0][1] + 1e-6 if predictions else DEFAULT_THRESHOLDS[self.method]
+        correct = 0
+        for accepted, (predicted, confidence, expected) in enumerate(predictions, start=1):
+            correct += predicted == expected
+            if correct / accepted >= target_accuracy:
+                threshold = confidence
+        self.threshold = threshold
+        self.threshold_source = "calibrated"
+
+        report = {**self.evaluate(queries, threshold), "target_accuracy": target_accuracy, "calibrated_at": time.time()}
+        calibration = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                calibration = json.load(f)
+        calibration[self.method] = report
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(calibration, f, indent=2)
+        return report
+
+
+class TenantResolver:
+    """
+    Resolves the tenant of a turn without the LLM whenever possible:
+    the tenant already resolved for the session, then the local classifier,
+    and only then `llm_fallback(user_input)`.
+    """
+    def __init__(self, classifier: TenantClassifier, llm_fallback):
+        self.classifier = classifier
+        self.llm_fallback = llm_fallback
+        self.session_tenants = {}
+        self.stats = {"session": 0, "classifier": 0, "llm": 0}
+
+    def resolve(self, session_id: str, user_input: str, query_embeddings: QueryEmbeddings):
+        if session_id in self.session_tenants:
+            self.stats["session"] += 1
+            return self.session_tenants[session_id]
+
+        tenant_id = None
+        try:
+            tenant_id, _ = self.classifier.classify(query_embeddings)
+        except Exception as e:
+            print(f"Local tenant classification failed, falling back to the LLM: {e}")
+
+        if tenant_id is not None:
+            self.stats["classifier"] += 1
+        else:
+            self.stats["llm"] += 1
+            tenant_id = self.llm_fallback(user_input)
+
+        self.session_tenants[session_id] = tenant_id
+        return tenant_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the tenant classifier thresholds on held-out tenant queries.")
+    parser.add_argument("--data-path", default=os.path.join(REPO_ROOT, "data"))
+    parser.add_argument("--target-accuracy", type=float, default=0.98)
+    args = parser.parse_args()
+
+    queries = load_tenant_queries(args.data_path)
+    client = QdrantClient(host="localhost", port=6333)
+    for method in DEFAULT_THRESHOLDS:
+        classifier = TenantClassifier(client, method=method)
+        print(f"Before: {classifier.evaluate(queries)} ({classifier.threshold_source})")
+        print(f"Calibrated: {classifier.calibrate(queries, args.target_accuracy)}")
@@ -1,16 +1,21 @@
 import uuid
-from lyzr_automata.pipelines.linear_sync_pipeline import LinearSyncPipeline
+import time
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 
-from llm import load_gemini_model
+from llm import load_gemini_model, get_completion_cache, COMPLETION_CACHE_ENABLED
 from utils import (
-     get_history, 
+     get_history,
      save_message,
      text_2_json,
+     get_valid_field,
+     JSONFieldStreamExtractor,
      task_with_feedback_loop
 )
 from agents_util.tasks import (
-     get_tenant_identification_task, 
+     get_tenant_identification_task,
      get_customer_info_extraction_task,
+     get_fused_extraction_task,
      get_ticket_extraction_task,
      get_faq_extraction_task,
      get_handbook_extraction_task,
@@ -23,133 +28,230 @@ from agents_util.tasks import (
      get_order_id_extraction_task,
      get_return_product_validation_task,
      get_product_quality_check_task,
+     get_return_inspection_context,
+     get_return_inspection_task,
      get_order_info_task
 )
+from agents_util.fast_extractors import get_extraction_stats
+from agents_util.local_classifiers import LOCAL_CLASSIFIER_MODE, log_llm_label
+from agents_util.stage_executor import StageExecutor, LocalTask, execute_with_input_tasks, stream_with_input_tasks
 from qdrant_util.caching import SemanticCache
+from qdrant_util.retrieval_cache import retrieval_cache
+from qdrant_util.qdrant_retriever import retrieve_turn_contexts, retrieve_customer_info, retrieve_order_info
+from qdrant_util.query_embedding import QueryEmbeddingCache
+from qdrant_util.tenant_classifier import TenantClassifier, TenantResolver
+
+from qdrant_client import QdrantClient
 
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
 GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME")
+# max number of stages (LLM calls + retrievals) in flight at once within a turn
+MAX_PARALLEL_STAGES = int(os.getenv("MAX_PARALLEL_STAGES", 8))
+# extract customer info, tickets, FAQs, policies and handbooks with one LLM call instead of five
+FUSED_EXTRACTION = os.getenv("FUSED_EXTRACTION", "false").lower() == "true"
+# "combined": one call returns both the return validation and quality check, "separate": two concurrent calls
+RETURN_INSPECTION_MODE = os.getenv("RETURN_INSPECTION_MODE", "combined")
+# print the response message token by token instead of waiting for the full JSON
+STREAM_RESPONSE = os.getenv("STREAM_RESPONSE", "true").lower() == "true"
 
 gemini_model = load_gemini_model(model_name=GEMINI_MODEL_NAME)
-cache = SemanticCache(threshold=0.2)
+qdrant = QdrantClient(host="localhost", port=6333)
+cache = SemanticCache(
+    threshold=0.2,
+    ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 24 * 60 * 60)),
+    max_entries_per_customer=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES_PER_CUSTOMER", 100)),
+    eviction_policy=os.getenv("SEMANTIC_CACHE_EVICTION_POLICY", "lru"),
+    write_behind=os.getenv("SEMANTIC_CACHE_WRITE_BEHIND", "true").lower() == "true",
+)
+# pending cache writes are flushed even if the session ends without "exit"
+atexit.register(cache.close)
+# embeddings of recent queries, shared by every retrieval and cache lookup of a turn
+query_embedding_cache = QueryEmbeddingCache(max_size=256)
 
 debug = False
 
-def run_session():
-    session_id = str(uuid.uuid4())
-    print(f"Session {session_id} started.")
-    
-    while True:
-        user_input = input("User: ")
-        # ask the user to provide with the user id for now
-        # but when this becomes a product, it can be directly taken from the request body
-        resolved_customer_id = 'CUST-010'
-        if user_input.lower() == "exit":
-            break
-
-        save_message(session_id, "user", user_input)
-
-        history = get_history(session_id)
-        tenant_task_response = get_tenant_identification_task(user_input).execute()
-        tenant_task_response = text_2_json(tenant_task_response)
-        resolved_tenant_id = tenant_task_response['response']['tenant_type']
-        # save_message(session_id, "TenantResolverAgent", tenant_task_response)
 
-        cached_response = cache.check_cache(user_input, resolved_tenant_id, resolved_customer_id)
-        if cached_response:
-            final_message = cached_response
+def resolve_tenant_with_llm(user_input):
+    tenant_task_response = get_tenant_identification_task(user_input).execute()
+    tenant_task_response = text_2_json(tenant_task_response)
+    # save_message(session_id, "TenantResolverAgent", tenant_task_response)
+    return tenant_task_response['response']['tenant_type']
+
+# the TenantResolverAgent is only called when the session has no tenant yet and the local classifier is unsure
+tenant_resolver = TenantResolver(TenantClassifier(qdrant, method="centroid"), resolve_tenant_with_llm)
+
+
+def build_turn_stages(user_input, history, session_id, resolved_tenant_id, resolved_customer_id, query_embeddings, include_response=True):
+    """
+    Declares every stage of a non-cached turn together with the stages it depends on.
+    Independent stages are run concurrently by the StageExecutor.
+    With `include_response=False` the graph stops before the response, so it can be streamed by the caller.
+    """
+    executor = StageExecutor(max_workers=MAX_PARALLEL_STAGES)
+
+    def customer_record():
+        return retrieve_customer_info(qdrant, resolved_tenant_id, resolved_customer_id)
+
+    # one prompt extracting all five fields, fields that fail validation fall back to their own extractor below
+    def fused_extraction(customer_record, retrievals):
+        try:
+            fused_task_response = get_fused_extraction_task(
+                user_input, customer_record, retrievals['helpdesk'],
+                retrievals['faqs'], retrievals['policy'], retrievals['handbook']
+            ).execute()
+            return text_2_json(fused_task_response)['response']
+        except Exception as e:
+            print(f"Fused extraction failed, falling back to individual extractors: {e}")
+            return {}
+
+    def customer_info(customer_record, fused_extraction=None):
+        fused_value = get_valid_field(fused_extraction, 'customer_info')
+        if fused_value is not None:
+            return fused_value
+        customer_info_task_response = get_customer_info_extraction_task(
+            user_input, resolved_tenant_id, resolved_customer_id, retrieved_context=customer_record
+        ).execute()
+        customer_info_task_response = text_2_json(customer_info_task_response)
+        return customer_info_task_response['response']['customer_info']
+
+    # helpdesk logs, FAQs, policies and handbooks are fetched together in one batched Qdrant query
+    def retrievals():
+        return retrieve_turn_contexts(
+            qdrant, user_input, resolved_customer_id, resolved_tenant_id,
+            top_k=3, k_prefetch=10, query_embeddings=query_embeddings
+        )
+
+    def tickets(retrievals, fused_extraction=None):
+        fused_value = get_valid_field(fused_extraction, 'related_tickets')
+        if fused_value is not None:
+            return fused_value
+        ticket_task_response = get_ticket_extraction_task(
+            user_input, resolved_customer_id, resolved_tenant_id, top_k=3, k_prefetch=10,
+            query_embeddings=query_embeddings, retrieved_context=retrievals['helpdesk']
+        ).execute()
+        ticket_task_response = text_2_json(ticket_task_response)
+        return ticket_task_response['response']['related_tickets']
+
+    # doesn't need to return anything if it doesn't find any related faq
+    # can have multiple faqs, if need be
+    # do not blindly rely on similarity with query value, use your own brain
+    def faqs(retrievals, fused_extraction=None):
+        fused_value = get_valid_field(fused_extraction, 'related_faqs')
+        if fused_value is not None:
+            return fused_value
+        relavant_faqs, _ = task_with_feedback_loop(
+            user_input, get_faq_extraction_task, resolved_tenant_id, 'related_faqs',
+            session_id, 'FAQsRetrieverAgent',"Couldn't find any FAQs related to the user query", top_k=3, k_prefetch=10,
+            query_embeddings=query_embeddings, retrieved_context=retrievals['faqs']
+        )
+        return relavant_faqs
+
+    def policies(retrievals, fused_extraction=None):
+        fused_value = get_valid_field(fused_extraction, 'related_policies')
+        if fused_value is not None:
+            return fused_value
+        relavant_policy, _ = task_with_feedback_loop(
+            user_input, get_policy_extraction_task, resolved_tenant_id, 'related_policies',
+            session_id, 'PolicyRetrieverAgent',"Couldn't find any policy related to the user query", top_k=3, k_prefetch=10,
+            query_embeddings=query_embeddings, retrieved_context=retrievals['policy']
+        )
+        return relavant_policy
+
+    def handbooks(retrievals, fused_extraction=None):
+        fused_value = get_valid_field(fused_extraction, 'related_handbooks')
+        if fused_value is not None:
+            return fused_value
+        relavant_handbook, _ = task_with_feedback_loop(
+            user_input, get_handbook_extraction_task, resolved_tenant_id, 'related_handbooks',
+            session_id, 'HandbookRetrieverAgent',"Couldn't find any handbook related to the user query", top_k=3, k_prefetch=10,
+            query_embeddings=query_embeddings, retrieved_context=retrievals['handbook']
+        )
+        return relavant_handbook
+
+    def image_path():
+        image_path_task_response = get_image_path_extraction_task(user_input).execute()
+        image_path_task_response = text_2_json(image_path_task_response)
+        return image_path_task_response['response']['image_path']
+
+    def order_id():
+        order_id_extraction_task = get_order_id_extraction_task(user_input).execute()
+        order_id_extraction_task = text_2_json(order_id_extraction_task)
+        return order_id_extraction_task['response']['order_id']
+
+    def order_record(order_id):
+        # Only process order info if order_id is not None and not empty
+        if not (order_id and order_id.strip()):
+            return None
+        try:
+            return retrieve_order_info(qdrant, resolved_tenant_id, resolved_customer_id, order_id)
+        except Exception as e:
+            return f"Could not retrieve order information for order ID: {order_id}. Error: {str(e)}"
+
+    def order_info(order_id, order_record):
+        if order_record is None:
+            return "No order ID found in the user query."
+        try:
+            order_info_task = get_order_info_task(resolved_tenant_id, resolved_customer_id, order_id, order_info=order_record).execute()
+            order_info_task = text_2_json(order_info_task)
+            return order_info_task['response']['order_info']
+        except Exception as e:
+            return f"Could not retrieve order information for order ID: {order_id}. Error: {str(e)}"
+
+    def return_checks(order_id, image_path, order_record):
+        if image_path and order_id and order_id.strip():
+            try:
+                # order info and the uploaded image's matches are fetched (and the image embedded) only once
+                context = get_return_inspection_context(
+                    resolved_tenant_id, resolved_customer_id, order_id, image_path, order_info=order_record
+                )
+                if RETURN_INSPECTION_MODE == "combined":
+                    return_inspection_task_response = get_return_inspection_task(resolved_tenant_id, resolved_customer_id, order_id, image_path, context=context).execute()
+                    return_inspection_task_response = text_2_json(return_inspection_task_response)['response']
+                    return_validation_check = return_inspection_task_response['return_validation']
+                    product_quality_check = return_inspection_task_response['quality_check']
+                else:
+                    with ThreadPoolExecutor(max_workers=2) as pool:
+                        return_validation_future = pool.submit(get_return_product_validation_task(resolved_tenant_id, resolved_customer_id, order_id, image_path, context=context).execute)
+                        product_quality_check_future = pool.submit(get_product_quality_check_task(resolved_tenant_id, resolved_customer_id, order_id, image_path, context=context).execute)
+                    return_validation_check = text_2_json(return_validation_future.result())['response']
+                    product_quality_check = text_2_json(product_quality_check_future.result())['response']
+            except Exception as e:
+                return_validation_check = f"Could not validate return for order {order_id}. Error: {str(e)}"
+                product_quality_check = f"Could not check product quality for order {order_id}. Error: {str(e)}"
         else:
-            customer_info_task_response = get_customer_info_extraction_task(user_input, resolved_tenant_id, resolved_customer_id).execute()
-            customer_info_task_response = text_2_json(customer_info_task_response)
-            final_customer_info = customer_info_task_response['response']['customer_info']
-            # save_message(session_id, "CustomerInfoRetrieverAgent", customer_info_task_response)
-
-            ticket_task_response = get_ticket_extraction_task(user_input, resolved_customer_id, resolved_tenant_id, top_k=3, k_prefetch=10).execute()
-            ticket_task_response = text_2_json(ticket_task_response)
-            relavant_ticket_info = ticket_task_response['response']['related_tickets']
-            # save_message(session_id, "TicketInfoRetrieverAgent", ticket_task_response)
-
-            # doesn't need to return anything if it doesn't find any related faq
-            # can have multiple faqs, if need be
-            # do not blindly rely on similarity with query value, use your own brain
-            relavant_faqs, faq_task_response = task_with_feedback_loop(
-                user_input, get_faq_extraction_task, resolved_tenant_id, 'related_faqs', 
-                session_id, 'FAQsRetrieverAgent',"Couldn't find any FAQs related to the user query", top_k=3, k_prefetch=10
-            )
-
-            relavant_policy, policy_task_response = task_with_feedback_loop(
-                user_input, get_policy_extraction_task, resolved_tenant_id, 'related_policies', 
-                session_id, 'PolicyRetrieverAgent',"Couldn't find any policy related to the user query", top_k=3, k_prefetch=10
-            )
-
-            relavant_handbook, handbook_task_response = task_with_feedback_loop(
-                user_input, get_handbook_extraction_task, resolved_tenant_id, 'related_handbooks', 
-                session_id, 'HandbookRetrieverAgent',"Couldn't find any handbook related to the user query", top_k=3, k_prefetch=10
-            )
-
-            image_path_task_response = get_image_path_extraction_task(user_input).execute()
-            image_path_task_response = text_2_json(image_path_task_response)
-            image_path = image_path_task_response['response']['image_path']
-
-            order_id_extraction_task = get_order_id_extraction_task(user_input).execute()
-            order_id_extraction_task = text_2_json(order_id_extraction_task)
-            order_id = order_id_extraction_task['response']['order_id']
-
-            # Only process order info if order_id is not None and not empty
-            if order_id and order_id.strip():
-                try:
-                    order_info_task = get_order_info_task(resolved_tenant_id, resolved_customer_id, order_id).execute()
-                    order_info_task = text_2_json(order_info_task)
-                    order_info = order_info_task['response']['order_info']
-                except Exception as e:
-                    order_info = f"Could not retrieve order information for order ID: {order_id}. Error: {str(e)}"
+            if not image_path:
+                return_validation_check = "Can't say as the user has not provided the image of the product"
+                product_quality_check = "Can't say as the user has not provided the image of the product"
             else:
-                order_info = "No order ID found in the user query."
-
-
-            if image_path and order_id and order_id.strip():
-                try:
-                    return_product_validation_task_response = get_return_product_validation_task(resolved_tenant_id, resolved_customer_id, order_id, image_path).execute()
-                    return_product_validation_task_response = text_2_json(return_product_validation_task_response)
-                    return_validation_check = return_product_validation_task_response['response']
-
-                    product_quality_check_task_response = get_product_quality_check_task(resolved_tenant_id, resolved_customer_id, order_id, image_path).execute()
-                    product_quality_check_task_response = text_2_json(product_quality_check_task_response)
-                    product_quality_check = product_quality_check_task_response['response']
-                except Exception as e:
-                    return_validation_check = f"Could not validate return for order {order_id}. Error: {str(e)}"
-                    product_quality_check = f"Could not check product quality for order {order_id}. Error: {str(e)}"
-            else:
-                if not image_path:
-                    return_validation_check = "Can't say as the user has not provided the image of the product"
-                    product_quality_check = "Can't say as the user has not provided the image of the product"
-                else:
-                    return_validation_check = "Can't process as no valid order ID was found"
-                    product_quality_check = "Can't process as no valid order ID was found"
+                return_validation_check = "Can't process as no valid order ID was found"
+                product_quality_check = "Can't process as no valid order ID was found"
+        return return_validation_check, product_quality_check
 
-            full_context = f"""
+    def full_context(customer_info, tickets, faqs, policies, handbooks, order_info, return_checks):
+        return_validation_check, product_quality_check = return_checks
+        return f"""
 Customer Info
 -------------
-{final_customer_info}
+{customer_info}
 
 Related User's Issued Tickets
 ------------------------------
-{relavant_ticket_info}
+{tickets}
 
 Relavant FAQs for the User Query
 ---------------------------------
-{relavant_faqs}
+{faqs}
 
 Relavant Policies for the User Query
 ---------------------------------
-{relavant_policy}
+{policies}
 
 Relavant Handbooks for the User Query
 ---------------------------------
-{relavant_handbook}
+{handbooks}
 
 Order Info
 ----------
@@ -160,52 +262,167 @@ Product Quality Check Info For Returing The Defect Free Product
 {product_quality_check}
 
 Product Return Validation Check
-------------------------------- 
+-------------------------------
 {return_validation_check}
 
 """
-# final_customer_info, relavant_ticket_info, relavant_policy, relavant_handbook, image_path, order_id, order_info, return_validation_check, product_quality_check, full_context
+
+    # routing and sentiment only need the user query, so they run alongside the retrievals
+    def routing():
+        routing_task = get_routing_task(user_input, query_embeddings=query_embeddings)
+        execute_with_input_tasks(routing_task)
+        if LOCAL_CLASSIFIER_MODE != "off" and not isinstance(routing_task, LocalTask):
+            log_llm_label("routing", user_input, routing_task.output)
+        return routing_task
+
+    def sentiment():
+        senti_task = get_sentiment_analysis_task(user_input, query_embeddings=query_embeddings)
+        execute_with_input_tasks(senti_task)
+        if LOCAL_CLASSIFIER_MODE != "off" and not isinstance(senti_task, LocalTask):
+            log_llm_label("sentiment", user_input, senti_task.output)
+        return senti_task
+
+    def escalation(routing, sentiment):
+        escalation_task = get_escalation_task(user_input, routing, sentiment, tenant_id=resolved_tenant_id)
+        execute_with_input_tasks(escalation_task)
+        return escalation_task
+
+    def response(full_context, routing, sentiment, escalation):
+        responding_task = get_response_task(full_context, history, routing, sentiment, escalation)
+        return execute_with_input_tasks(responding_task)
+
+    fused_inputs = []
+    if FUSED_EXTRACTION:
+        executor.add_stage("fused_extraction", fused_extraction, inputs=["customer_record", "retrievals"])
+        fused_inputs = ["fused_extraction"]
+
+    executor.add_stage("customer_record", customer_record)
+    executor.add_stage("retrievals", retrievals)
+    executor.add_stage("customer_info", customer_info, inputs=["customer_record"] + fused_inputs)
+    executor.add_stage("tickets", tickets, inputs=["retrievals"] + fused_inputs)
+    executor.add_stage("faqs", faqs, inputs=["retrievals"] + fused_inputs)
+    executor.add_stage("policies", policies, inputs=["retrievals"] + fused_inputs)
+    executor.add_stage("handbooks", handbooks, inputs=["retrievals"] + fused_inputs)
+    executor.add_stage("image_path", image_path)
+    executor.add_stage("order_id", order_id)
+    executor.add_stage("order_record", order_record, inputs=["order_id"])
+    executor.add_stage("order_info", order_info, inputs=["order_id", "order_record"])
+    executor.add_stage("return_checks", return_checks, inputs=["order_id", "image_path", "order_record"])
+    executor.add_stage(
+        "full_context", full_context,
+        inputs=["customer_info", "tickets", "faqs", "policies", "handbooks", "order_info", "return_checks"]
+    )
+    executor.add_stage("routing", routing)
+    executor.add_stage("sentiment", sentiment)
+    executor.add_stage("escalation", escalation, inputs=["routing", "sentiment"])
+    if include_response:
+        executor.add_stage("response", response, inputs=["full_context", "routing", "sentiment", "escalation"])
+    return executor
+
+
+def stream_response(responding_task):
+    """
+    Prints the response message while it is being generated.
+    Returns (final message, is_valid), is_valid is False when the output wasn't the expected JSON.
+    """
+    extractor = JSONFieldStreamExtractor("message")
+    streamed_message = []
+    print("Agent: ", end="", flush=True)
+    for chunk in stream_with_input_tasks(responding_task):
+        message_chunk = extractor.feed(chunk)
+        streamed_message.append(message_chunk)
+        print(message_chunk, end="", flush=True)
+
+    try:
+        final_message = text_2_json(responding_task.output)['response']['message']
+        is_valid = True
+    except (ValueError, KeyError, TypeError):
+        is_valid = False
+        # the response wasn't valid JSON, keep whatever could be extracted from the stream
+        final_message = "".join(streamed_message)
+        if not final_message:
+            final_message = responding_task.output
+            print(final_message, end="")
+    print()
+    return final_message, is_valid
+
+
+def run_session():
+    session_id = str(uuid.uuid4())
+    print(f"Session {session_id} started.")
+    cache.start_sweeper()
+
+    while True:
+        user_input = input("User: ")
+        # ask the user to provide with the user id for now
+        # but when this becomes a product, it can be directly taken from the request body
+        resolved_customer_id = 'CUST-010'
+        if user_input.lower() == "exit":
+            cache.close()
             if debug:
+                print('Semantic Cache Metrics:\n\t', cache.get_metrics())
+                print('Retrieval Cache Stats:\n\t', retrieval_cache.get_stats())
+                if COMPLETION_CACHE_ENABLED:
+                    print('Completion Cache Stats:\n\t', get_completion_cache().get_stats())
+            break
+
+        save_message(session_id, "user", user_input)
+
+        history = get_history(session_id)
+        query_embeddings = query_embedding_cache.get(user_input)
+        resolved_tenant_id = tenant_resolver.resolve(session_id, user_input, query_embeddings)
+
+        response_printed = False
+        cached_response = cache.check_cache(user_input, resolved_tenant_id, resolved_customer_id, query_embeddings=query_embeddings)
+        if cached_response:
+            final_message = cached_response
+        else:
+            start_time = time.time()
+            executor = build_turn_stages(
+                user_input, history, session_id, resolved_tenant_id, resolved_customer_id, query_embeddings,
+                include_response=not STREAM_RESPONSE
+            )
+            results = executor.run()
+
+            if debug:
+                return_validation_check, product_quality_check = results['return_checks']
                 print('Resolved Customer ID:\n\t', resolved_customer_id)
                 print('Resolved Tenant ID:\n\t', resolved_tenant_id)
-                print('Extracted Customer Info:\n\t', final_customer_info)
-                print('Extracted Tickets:\n\t', relavant_ticket_info)
-                print('Extracted FAQs:\n\t', relavant_faqs)
-                print('Extracted Policies:\n\t', relavant_policy)
-                print('Extracted Handbooks:\n\t', relavant_handbook)
-                print('Extracted Image Path:\n\t', image_path)
-                print('Extracted Order ID:\n\t', order_id)
-                print('Extracted Order Info:\n\t', order_info)
+                print('Extracted Customer Info:\n\t', results['customer_info'])
+                print('Extracted Tickets:\n\t', results['tickets'])
+                print('Extracted FAQs:\n\t', results['faqs'])
+                print('Extracted Policies:\n\t', results['policies'])
+                print('Extracted Handbooks:\n\t', results['handbooks'])
+                print('Extracted Image Path:\n\t', results['image_path'])
+                print('Extracted Order ID:\n\t', results['order_id'])
+                print('Extracted Order Info:\n\t', results['order_info'])
                 print('Extracted Return Validation Check:\n\t', return_validation_check)
                 print('Extracted Product Quality Check:\n\t', product_quality_check)
-                print('Full Context:\n\t', full_context)
-                
-
-            routing_task = get_routing_task(user_input)
-            senti_task = get_sentiment_analysis_task(user_input)
-            escalation_task = get_escalation_task(user_input, routing_task, senti_task)
-            responding_task = get_response_task(full_context, history, routing_task, senti_task, escalation_task)
-
-
-            pipeline = LinearSyncPipeline(
-                name="MultiAgentSupport",
-                completion_message="Done",
-                tasks=[
-                    routing_task,
-                    senti_task,
-                    escalation_task,
-                    responding_task
-                ]
-            )
-            outputs = pipeline.run()
-
-            response = outputs[-1]['task_output']
-            response = text_2_json(response)
-            final_message = response['response']['message']
-            cache.add_to_cache(user_input, final_message, resolved_tenant_id, resolved_customer_id)
-
-        print(f"Agent: {final_message}")
+                print('Full Context:\n\t', results['full_context'])
+                print('Query Embedding Stats:\n\t', query_embeddings.stats, query_embedding_cache.get_stats())
+                print('Tenant Resolution Stats:\n\t', tenant_resolver.stats)
+                print('Extraction Path Stats:\n\t', get_extraction_stats())
+                print('Stage Durations:\n\t', {name: round(t['duration'], 3) for name, t in executor.timings.items()})
+                print(f'Turn Latency:\n\t {time.time() - start_time:.3f}s')
+
+            if STREAM_RESPONSE:
+                responding_task = get_response_task(
+                    results['full_context'], history, results['routing'], results['sentiment'], results['escalation']
+                )
+                final_message, is_valid = stream_response(responding_task)
+                response_printed = True
+            else:
+                response = text_2_json(results['response'])
+                final_message = response['response']['message']
+                is_valid = True
+            # the cache is only written once the user has the full answer,
+            # and never with a malformed one that would be replayed to every similar query
+            if is_valid:
+                cache.add_to_cache(user_input, final_message, resolved_tenant_id, resolved_customer_id, query_embeddings=query_embeddings)
+
+        if not response_printed:
+            print(f"Agent: {final_message}")
         save_message(session_id, "assistant", final_message)
 
 if __name__ == "__main__":
-    run_session()
\ No newline at end of file
+    run_session()
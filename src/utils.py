@@ -1,6 +1,8 @@
 import re
 import json
 
+JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
 # In-memory conversation storage (replace with a DB or Qdrant in prod)
 conversation_history = {}
 
@@ -21,6 +23,90 @@ def text_2_json(response):
     response = json.loads(response)
     return response
 
+def parse_hex(digits):
+    """The value of exactly four hex digits, or None."""
+    if len(digits) != 4 or any(digit not in "0123456789abcdefABCDEF" for digit in digits):
+        return None
+    return int(digits, 16)
+
+class JSONFieldStreamExtractor:
+    """
+    Incrementally extracts the string value of one JSON field from a streamed response.
+    `feed(chunk)` returns the newly decoded characters of the field's value, if any.
+    """
+    def __init__(self, field="message"):
+        self.key_pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self.buffer = ""
+        self.position = None  # index in buffer where the value's unread characters start
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if self.position is None:
+            match = self.key_pattern.search(self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+
+        decoded = []
+        i = self.position
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char == '\\':
+                # wait for the rest of the escape sequence
+                if i + 1 >= len(self.buffer):
+                    break
+                escape = self.buffer[i + 1]
+                if escape == 'u':
+                    if i + 6 > len(self.buffer):
+                        break
+                    code_point = parse_hex(self.buffer[i + 2:i + 6])
+                    if code_point is None:
+                        # malformed escape in the model output, keep it as literal text
+                        decoded.append("\\u")
+                        i += 2
+                        continue
+                    if 0xD800 <= code_point <= 0xDBFF:
+                        # characters outside the BMP arrive as an escaped surrogate pair, wait for the low half
+                        low_escape = self.buffer[i + 6:i + 12]
+                        if len(low_escape) < 6 and low_escape[:2] in ("", "\\", "\\u"):
+                            break
+                        low_code_point = parse_hex(low_escape[2:]) if low_escape.startswith("\\u") else None
+                        if low_code_point is not None and 0xDC00 <= low_code_point <= 0xDFFF:
+                            decoded.append(chr(0x10000 + ((code_point - 0xD800) << 10) + low_code_point - 0xDC00))
+                            i += 12
+                            continue
+                    if 0xD800 <= code_point <= 0xDFFF:
+                        # a lone surrogate can't be printed or encoded
+                        code_point = 0xFFFD
+                    decoded.append(chr(code_point))
+                    i += 6
+                    continue
+                decoded.append(JSON_ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            decoded.append(char)
+            i += 1
+        self.position = i
+        return "".join(decoded)
+
+def get_valid_field(response, field):
+    """Returns response[field] if it holds a usable value, else None."""
+    if not isinstance(response, dict):
+        return None
+    value = response.get(field)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if not isinstance(value, (str, list, dict)):
+        return None
+    return value
+
 def task_with_feedback_loop(
     user_input,
     task_name,
@@ -30,7 +116,9 @@ def task_with_feedback_loop(
     agent_name,
     fallback_message,
     top_k=3,
-    k_prefetch=10
+    k_prefetch=10,
+    query_embeddings=None,
+    retrieved_context=None
 ):
 
     fail_count = 0
@@ -38,7 +126,7 @@ def task_with_feedback_loop(
     fail_feedback = None
     while need_decoding:
         try:
-            task_response = task_name(user_input, tenant_id, top_k=top_k, k_prefetch=k_prefetch, fail_feedback=fail_feedback).execute()
+            task_response = task_name(user_input, tenant_id, top_k=top_k, k_prefetch=k_prefetch, fail_feedback=fail_feedback, query_embeddings=query_embeddings, retrieved_context=retrieved_context).execute()
             task_response = text_2_json(task_response)
             relevant_response = task_response['response'][task_response_keyword]
             # save_message(session_id, agent_name, task_response)
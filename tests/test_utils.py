@@ -0,0 +1,29 @@
+import os
+import sys
+import json
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from utils import JSONFieldStreamExtractor
+
+
+def stream(text, chunk_size):
+    extractor = JSONFieldStreamExtractor("message")
+    return "".join(extractor.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size))
+
+
+def test_non_bmp_character_split_across_chunks():
+    message = 'Refund issued \U0001F600 for "order" #42\n'
+    response = json.dumps({"response": {"message": message}})
+    assert "\\ud83d\\ude00" in response
+    for chunk_size in range(1, 16):
+        streamed = stream(response, chunk_size)
+        assert streamed == message
+        streamed.encode("utf-8")
+
+
+def test_lone_surrogate_is_replaced():
+    assert stream('{"message": "a\\ud83d b\\ude00"}', 3) == "a\ufffd b\ufffd"
+
+
+def test_malformed_unicode_escape_is_kept_as_text():
+    assert stream('{"message": "bad \\uZZ12 escape, bad pair \\ud83d\\uXYZW"}', 4) == "bad \\uZZ12 escape, bad pair \ufffd\\uXYZW"